@@ -8,5 +8,6 @@ from .dtype import *
 from .reader import *
 from .writer import *
 from .stream import *
+from .index import *
 from .filter import *
 from .buffer import *
@@ -0,0 +1,287 @@
+""" Compile field definitions into specialized record functions.
+
+Converting between text tokens and Python values one field at a time costs a
+Python method call per field. For the builtin scalar types the conversion can
+be expressed as a few inline operations, so the field list for a schema is
+compiled once into a single function that handles an entire record.
+
+"""
+from __future__ import absolute_import
+
+from .dtype import ArrayType
+from .dtype import CategoricalType
+from .dtype import ConstType
+from .dtype import DatetimeType
+from .dtype import FloatType
+from .dtype import IntType
+from .dtype import StringType
+
+
+# The builtin types whose encode() always returns a single string token.
+
+_SCALAR_TYPES = (ConstType, IntType, FloatType, StringType, CategoricalType,
+                 DatetimeType)
+
+
+# Compiled functions are cached by schema so that readers and writers created
+# for the same field definitions (e.g. by a ReaderSequence) share them. The
+# cache holds references to its _DataTypes, so its size is limited.
+
+_CACHE_SIZE = 256
+_cache = {}
+
+
+def decoder(fields, seq, prelude="", **env):
+    """ Return a function that decodes a line of text into a record.
+
+    The fields argument is a sequence of Field objects. Each field's token is
+    obtained by indexing the seq variable with the field position, and seq can
+    be defined by prelude, a statement that is executed before any fields are
+    decoded, e.g. "tokens = line.split(delim)". The input line is always
+    available as "line". Any additional keyword arguments are made available as
+    global variables in the compiled function.
+
+    """
+    key = ("decode", seq, prelude, tuple(sorted(env.items())),
+           tuple((field.name, _index(field.pos), field.dtype) for field in
+                 fields))
+    try:
+        return _cache[key]
+    except KeyError:  # not compiled yet
+        pass
+    except TypeError:  # unhashable key, e.g. a mutable env value
+        key = None
+    namespace = dict(env)
+    source = ["def decode(line):"]
+    if prelude:
+        source.append("    {0:s}".format(prelude))
+    values = []
+    for pos, field in enumerate(fields):
+        token = "{0:s}[{1:s}]".format(seq, _index(field.pos))
+        for line in _decode_source(pos, field.dtype, token, namespace):
+            source.append("    {0:s}".format(line))
+        namespace["n{0:d}".format(pos)] = field.name
+        values.append("n{0:d}: v{0:d}".format(pos))
+    source.append("    return {{{0:s}}}".format(", ".join(values)))
+    func = _define("decode", source, namespace)
+    if key is not None:
+        if len(_cache) >= _CACHE_SIZE:
+            _cache.clear()
+        _cache[key] = func
+    return func
+
+
+def encoder(fields, delim, endl):
+    """ Return a function that encodes a record as a line of text.
+
+    The fields argument is a sequence of Field objects. The encoded tokens are
+    joined by delim, and endl is appended to the line. If there are no array
+    fields each line is produced by a single call to a precomputed format
+    template.
+
+    """
+    key = ("encode", delim, endl,
+           tuple((field.name, field.dtype) for field in fields))
+    try:
+        return _cache[key]
+    except KeyError:  # not compiled yet
+        pass
+    except TypeError:  # unhashable key
+        key = None
+    namespace = {"endl": endl, "join": delim.join}
+    source = ["def encode(record):", "    get = record.get"]
+    tokens = []  # statements that build a token list
+    slots = []  # template slots for the current run of scalar fields
+    args = []  # template arguments for the current run of scalar fields
+
+    def template(suffix=""):
+        """ Return a template call for the current run of scalar fields. """
+        name = "s{0:d}".format(len(tokens))
+        namespace[name] = (_escape(delim).join(slots) + suffix).format
+        call = "{0:s}({1:s})".format(name, ", ".join(args))
+        del slots[:]
+        del args[:]
+        return call
+
+    for pos, field in enumerate(fields):
+        namespace["n{0:d}".format(pos)] = field.name
+        if type(field.dtype) not in _SCALAR_TYPES:
+            # An array field is a sequence of tokens with a variable length,
+            # and a custom type may also return a sequence of tokens, so the
+            # line must be built from a list of tokens.
+            if slots:
+                tokens.append("tokens.append({0:s})".format(template()))
+            namespace["a{0:d}".format(pos)] = field.dtype.encode
+            if isinstance(field.dtype, ArrayType):
+                tokens.append("tokens.extend(a{0:d}(get(n{0:d})))".format(pos))
+                continue
+            tokens.extend([
+                "token = a{0:d}(get(n{0:d}))".format(pos),
+                "if isinstance(token, basestring):",
+                "    tokens.append(token)",
+                "else:",
+                "    tokens.extend(token)"])
+            continue
+        slot, lines = _encode_source(pos, field.dtype, namespace)
+        if lines:
+            for line in lines:
+                source.append("    {0:s}".format(line))
+            prefix, spec, suffix = slot
+            slot = "{0:s}{{{1:d}{2:s}}}{3:s}".format(prefix, len(args), spec,
+                                                     suffix)
+            args.append("v{0:d}".format(pos))
+        slots.append(slot)
+    if not tokens:
+        # All scalar fields, so the entire line is a single template.
+        source.append("    return {0:s}".format(template(_escape(endl))))
+    else:
+        if slots:
+            tokens.append("tokens.append({0:s})".format(template()))
+        source.append("    tokens = []")
+        for token in tokens:
+            source.append("    {0:s}".format(token))
+        source.append("    return join(tokens) + endl")
+    func = _define("encode", source, namespace)
+    if key is not None:
+        if len(_cache) >= _CACHE_SIZE:
+            _cache.clear()
+        _cache[key] = func
+    return func
+
+
+def _decode_source(pos, dtype, token, namespace):
+    """ Return the source code lines for decoding a single field.
+
+    The decoded value is assigned to the local variable v<pos>. Any variables
+    needed by the code are added to namespace.
+
+    """
+    # Exact type checks are used so that derived classes that override
+    # decode() are not inlined.
+    value = "v{0:d}".format(pos)
+    default = "d{0:d}".format(pos)
+    namespace[default] = dtype._default
+    kind = type(dtype)
+    if kind is ConstType:
+        return ["{0:s} = {1:s}".format(value, default)]
+    if kind in (IntType, FloatType):
+        # The int() and float() constructors ignore leading and trailing
+        # whitespace, so there is no need to strip the token.
+        convert = "t{0:d}".format(pos)
+        namespace[convert] = dtype._dtype
+        return [
+            "try:",
+            "    {0:s} = {1:s}({2:s})".format(value, convert, token),
+            "except ValueError:",
+            "    {0:s} = {1:s}".format(value, default)]
+    if kind in (StringType, CategoricalType):
+        if dtype._quote:
+            quote = "q{0:d}".format(pos)
+            namespace[quote] = dtype._quote
+            token = "{0:s}.strip().strip({1:s})".format(token, quote)
+        else:
+            token = "{0:s}.strip()".format(token)
+        source = ["{0:s} = {1:s} or {2:s}".format(value, token, default)]
+        if kind is CategoricalType:
+            # Look up the code for the string, and only call code() for a new
+            # category.
+            codes = "k{0:d}".format(pos)
+            code = "c{0:d}".format(pos)
+            namespace[codes] = dtype._codes
+            namespace[code] = dtype.code
+            source.extend([
+                "if {0:s} is not None:".format(value),
+                "    try:",
+                "        {0:s} = {1:s}[{0:s}]".format(value, codes),
+                "    except KeyError:",
+                "        {0:s} = {1:s}({0:s})".format(value, code)])
+        return source
+    decode = "f{0:d}".format(pos)
+    namespace[decode] = dtype.decode
+    return ["{0:s} = {1:s}({2:s})".format(value, decode, token)]
+
+
+def _encode_source(pos, dtype, namespace):
+    """ Return the template slot and source code for encoding a single field.
+
+    The source code assigns the template argument for this field to the local
+    variable v<pos>, and the slot is a (prefix, spec, suffix) tuple for its
+    replacement field. If there is no source code the slot is literal text.
+    This is only used for the builtin scalar types, whose encode() always
+    returns a single string.
+
+    """
+    # Exact type checks are used so that derived classes that override
+    # encode() are not inlined. Format specs with braces can't be used in a
+    # template.
+    value = "v{0:d}".format(pos)
+    default = "d{0:d}".format(pos)
+    get = "get(n{0:d})".format(pos)
+    kind = type(dtype)
+    if kind is ConstType:
+        return _escape(dtype.encode(None)), []
+    if kind in (IntType, FloatType) and _inline(dtype._fmt):
+        # A missing value is encoded as a blank string if there is no default.
+        namespace[default] = _BLANK if dtype._default is None else \
+                             dtype._default
+        return ("", ":" + dtype._fmt, ""), [
+            "{0:s} = {1:s}".format(value, get),
+            "if {0:s} is None:".format(value),
+            "    {0:s} = {1:s}".format(value, default)]
+    if kind is StringType and _inline(dtype._fmt):
+        namespace[default] = dtype._default or ""
+        quote = _escape(dtype._quote)
+        return (quote, ":" + dtype._fmt, quote), [
+            "{0:s} = {1:s} or {2:s}".format(value, get, default)]
+    encode = "e{0:d}".format(pos)
+    namespace[encode] = dtype.encode
+    return ("", "", ""), ["{0:s} = {1:s}({2:s})".format(value, encode, get)]
+
+
+def _inline(fmt):
+    """ Return True if a format spec can be used in a template.
+
+    """
+    return "{" not in fmt and "}" not in fmt
+
+
+class _Blank(object):
+    """ A template argument that is formatted as a blank string.
+
+    """
+    def __format__(self, spec):
+        """ Return a blank string for any format spec.
+
+        """
+        return ""
+
+
+_BLANK = _Blank()
+
+
+def _escape(text):
+    """ Escape literal text for use in a format template.
+
+    """
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+def _index(pos):
+    """ Return the source code for a field position used as an index.
+
+    """
+    try:
+        beg, end = pos.start, pos.stop
+    except AttributeError:  # an int
+        return str(pos)
+    return ":".join("" if idx is None else str(idx) for idx in (beg, end))
+
+
+def _define(name, source, namespace):
+    """ Compile source code and return the function it defines.
+
+    """
+    code = compile("\n".join(source), "<serial.core {0:s}>".format(name),
+                   "exec")
+    exec(code, namespace)
+    return namespace[name]
@@ -3,6 +3,16 @@
 """
 from __future__ import absolute_import
 
+from cPickle import HIGHEST_PROTOCOL
+from cPickle import dump
+from cPickle import load
+from datetime import datetime
+from itertools import islice
+from math import ceil
+from math import log
+from os import remove
+from tempfile import TemporaryFile
+
 
 class Field(object):
     """ A serial data field.
@@ -31,64 +41,411 @@ class Field(object):
 
 
 class TimeFormat(object):
-    """ Convert datetime-like objects to formatted strings. 
-    
-    This is a replacement for datetime.strftime that handles years before 1900.    
-    Only the most basic fields are supported, and it is not locale-aware.
-    
+    """ Convert datetime-like objects to formatted strings.
+
+    This is a replacement for datetime.strftime that handles years before 1900.
+    Only the most basic fields are supported, and it is not locale-aware. The
+    format is compiled into a function that renders every field with a single
+    %-style template.
+
     """
     _escape = "%"
     _field_defs = {
-        "d": ("02d", lambda time: time.day),
-        "f": ("06d", lambda time: time.microsecond),
-        "H": ("02d", lambda time: time.hour),
-        "I": ("02d", lambda time: time.hour%12),
-        "M": ("02d", lambda time: time.minute),
-        "m": ("02d", lambda time: time.month),
-        "p": ("s", lambda time: "AM" if time.hour < 12 else "PM"),  # no locale
-        "S": ("02d", lambda time: time.second),
-        "Y": ("04d", lambda time: time.year),
-        "y": ("02d", lambda time: time.year%100)}
+        "d": ("%02d", "time.day", True),
+        "f": (None, "time.microsecond", False),  # prec digits
+        "H": ("%02d", "time.hour", True),
+        "I": ("%02d", "(time.hour % 12 or 12)", True),
+        "M": ("%02d", "time.minute", False),
+        "m": ("%02d", "time.month", True),
+        "p": ("%s", "('AM' if time.hour < 12 else 'PM')", True),  # no locale
+        "S": ("%02d", "time.second", False),
+        "Y": ("%04d", "time.year", True),
+        "y": ("%02d", "time.year % 100", True)}
 
-    def __init__(self, timefmt):
+    def __init__(self, timefmt, prec=6):
         """ Initialize this object.
-        
-        """
-        def scan():
-            """ Iterate over timefmt while unescaping characters. """
-            esc = False
-            for char in timefmt:
-                if char == self._escape and not esc:
-                    # An unescaped escape character.
-                    esc = True
-                else:
-                    # A regular character.
-                    yield char, esc
-                    esc = False
-            return
 
+        The precision argument is the number of digits to use for fractional
+        seconds (%f), from 1 to 6; extra digits are truncated.
+
+        """
         # The presumed use case is multiple conversions using the same format
-        # string, so scan the string once and build a template.
-        self._template = []
-        self._fields = []
-        for char, esc in scan():
-            if not esc:
+        # string, so compile the format once.
+        prec = min(max(prec, 1), 6)
+        parts = []  # (slot, value, cacheable)
+        for char, esc in _scan(timefmt, self._escape):
+            if not esc or char == self._escape:
                 # A character literal
-                self._template.append(char)
+                parts.append((char.replace("%", "%%"), None, True))
                 continue
-            # Add a new field.
             try:
-                field = self._field_defs[char]
-            except:
+                slot, value, cacheable = self._field_defs[char]
+            except KeyError:
                 raise ValueError("uknown field specifier: {0:s}".format(char))
-            self._template.append("{{{0:d}:s}}".format(len(self._fields)))
-            self._fields.append(field)
-        self._template = "".join(self._template)
+            if slot is None:
+                slot = "%0{0:d}d".format(prec)
+                value = "{0:s} // {1:d}".format(value, 10**(6 - prec))
+            parts.append((slot, value, cacheable))
+        split = len(parts)
+        for pos, (slot, value, cacheable) in enumerate(parts):
+            if not cacheable:
+                split = pos
+                break
+        prefix, suffix = parts[:split], parts[split:]
+        source = ["def format(time):"]
+        if len([part for part in prefix if part[1]]) > 1:
+            # The leading date and hour fields are rendered once and cached for
+            # consecutive values from the same day or hour. The cache is a
+            # single tuple so that updates are atomic.
+            if any(part[1] and "hour" in part[1] for part in prefix):
+                key = "time.toordinal() * 24 + time.hour"
+            else:
+                key = "time.toordinal()"
+            source.extend([
+                "    key = {0:s}".format(key),
+                "    cached = cache[0]",
+                "    if key != cached[0]:",
+                "        cached = (key, {0:s})".format(_template(prefix)),
+                "        cache[0] = cached"])
+            if suffix:
+                source.append("    return cached[1] + {0:s}".format(
+                    _template(suffix)))
+            else:
+                source.append("    return cached[1]")
+        else:
+            source.append("    return {0:s}".format(_template(parts)))
+        namespace = {"cache": [(None, None)]}
+        code = compile("\n".join(source), "<serial.core format>", "exec")
+        exec(code, namespace)
+        self.format = namespace["format"]
         return
 
     def __call__(self, time):
         """ Convert a datetime to a string.
-        
+
+        """
+        return self.format(time)
+
+
+# The datetime constructor arguments and their defaults for TimeParser.
+
+_DATETIME_ARGS = (("year", "1900"), ("month", "1"), ("day", "1"),
+                  ("hour", "0"), ("minute", "0"), ("second", "0"),
+                  ("microsecond", "0"))
+
+
+class TimeParser(object):
+    """ Convert formatted strings to datetimes.
+
+    This is a faster replacement for datetime.strptime for formats that only
+    use numeric fields. The format is compiled into a function that converts
+    fixed slices of a string to ints, and strptime is used for any format or
+    string this can't handle.
+
+    """
+    _escape = "%"
+    _field_defs = {
+        "d": (2, "day"),
+        "f": (None, "microsecond"),  # 1 to 6 digits
+        "H": (2, "hour"),
+        "M": (2, "minute"),
+        "m": (2, "month"),
+        "S": (2, "second"),
+        "Y": (4, "year"),
+        "y": (2, "year")}
+
+    def __init__(self, timefmt):
+        """ Initialize this object.
+
+        """
+        def strptime(token):
+            """ Parse a string that the compiled function can't handle. """
+            return datetime.strptime(token, timefmt)
+
+        self.parse = strptime  # fallback for unsupported formats
+        spans = []  # [beg, end, text] for literals, or text is None for digits
+        fields = {}  # name -> (beg, end, source)
+        pos = 0
+        for char, esc in _scan(timefmt, self._escape):
+            if pos is None:
+                # Only a trailing %f is supported.
+                return
+            if not esc:
+                if spans and spans[-1][2] is not None:
+                    spans[-1][1] += 1
+                    spans[-1][2] += char
+                else:
+                    spans.append([pos, pos + 1, char])
+                pos += 1
+                continue
+            try:
+                width, name = self._field_defs[char]
+            except KeyError:  # not supported
+                return
+            if name in fields:
+                return
+            if width is None:
+                # Pad the fraction to microseconds.
+                value = "int(token[{0:d}:].ljust(6, '0'))".format(pos)
+                fields[name] = (pos, pos, value)
+                minimum, maximum = pos + 1, pos + 6
+                end = None
+            else:
+                value = "int(token[{0:d}:{1:d}])".format(pos, pos + width)
+                if char == "y":
+                    # Use the same century as strptime.
+                    value = "{0:s} + (1900 if {0:s} >= 69 else 2000)".format(
+                        value)
+                fields[name] = (pos, pos + width, value)
+                end = pos + width
+            if spans and spans[-1][2] is None:
+                spans[-1][1] = end
+            else:
+                spans.append([pos, end, None])
+            pos = end
+        if pos is not None:
+            minimum = maximum = pos
+        values = []
+        for name, default in _DATETIME_ARGS:
+            try:
+                values.append(fields[name][2])
+            except KeyError:
+                values.append(default)
+        # Each literal must match the format at its fixed position, and each
+        # field must only contain digits, so a field can't contain a sign or
+        # whitespace.
+        checks = ["{0:d} <= len(token) <= {1:d}".format(minimum, maximum)]
+        date_checks = []
+        date = [fields[name] for name in ("year", "month", "day") if name in
+                fields]
+        if date:
+            beg = min(field[0] for field in date)
+            end = max(field[1] for field in date)
+            if any(beg <= field[0] < end for field in fields.values() if
+                   field not in date):
+                date = None
+        for span in spans:
+            text = "token[{0:d}:{1:s}]".format(span[0], "" if span[1] is
+                                                None else str(span[1]))
+            if span[2] is None:
+                check = "{0:s}.isdigit()".format(text)
+            else:
+                check = "{0:s} == {1!r}".format(text, span[2])
+            if date and span[1] is not None and beg <= span[0] and \
+                    span[1] <= end:
+                # A cached date has already been checked.
+                date_checks.append(check)
+            else:
+                checks.append(check)
+        source = [
+            "def parse(token):",
+            "    try:",
+            "        if not ({0:s}):".format(" and ".join(checks)),
+            "            raise ValueError"]
+        if date:
+            # The date fields are a contiguous part of the string, so their
+            # values can be cached for consecutive strings from the same day.
+            # The cache is a single tuple so that updates are atomic.
+            source.extend([
+                "        date = token[{0:d}:{1:d}]".format(beg, end),
+                "        cached = cache[0]",
+                "        if date == cached[0]:",
+                "            year, month, day = cached[1]",
+                "        else:"])
+            if date_checks:
+                source.extend([
+                    "            if not ({0:s}):".format(
+                        " and ".join(date_checks)),
+                    "                raise ValueError"])
+            source.extend([
+                "            year, month, day = {0:s}".format(
+                    ", ".join(values[:3])),
+                "            cache[0] = (date, (year, month, day))"])
+            values[:3] = ["year", "month", "day"]
+        source.extend([
+            "        return datetime({0:s})".format(", ".join(values)),
+            "    except (ValueError, TypeError):",
+            "        return strptime(token)"])
+        namespace = {
+            "cache": [(None, None)],
+            "datetime": datetime,
+            "strptime": strptime}
+        code = compile("\n".join(source), "<serial.core parse>", "exec")
+        exec(code, namespace)
+        self.parse = namespace["parse"]
+        return
+
+    def __call__(self, token):
+        """ Convert a string to a datetime.
+
+        """
+        return self.parse(token)
+
+
+class SpillFile(object):
+    """ Temporary on-disk storage for a sequence of records.
+
+    Records are pickled in chunks, so a SpillFile can be written to and read
+    back in bounded memory. This is used by buffers that would otherwise have
+    to hold an unlimited number of records in memory.
+
+    """
+    chunk_size = 1024  # records per pickle
+
+    def __init__(self, path=None):
+        """ Initialize this object.
+
+        By default an anonymous temporary file is used. Otherwise, path is a
+        file to use for storage, which is created if necessary and deleted
+        when this object is closed.
+
+        """
+        if path is None:
+            self._stream = TemporaryFile()
+        else:
+            self._stream = open(path, "a+b")
+        self._path = path
+        return
+
+    def write(self, records):
+        """ Append a sequence of records to the file.
+
+        """
+        self._stream.seek(0, 2)
+        records = iter(records)
+        while True:
+            chunk = list(islice(records, self.chunk_size))
+            if not chunk:
+                break
+            dump(chunk, self._stream, HIGHEST_PROTOCOL)
+        self._stream.flush()
+        return
+
+    def __iter__(self):
+        """ Iterate over all records in the file.
+
+        Only one chunk at a time is held in memory. Writing to the file while
+        iterating over it is not supported.
+
+        """
+        self._stream.seek(0)
+        while True:
+            try:
+                chunk = load(self._stream)
+            except EOFError:
+                break
+            for record in chunk:
+                yield record
+        return
+
+    def close(self, delete=True):
+        """ Close the file.
+
+        A named file is deleted unless delete is False.
+
+        """
+        self._stream.close()
+        if self._path is not None and delete:
+            remove(self._path)
+        return
+
+
+_MASK64 = (1 << 64) - 1
+
+
+def hash64(value, seed):
+    """ Return a 64-bit hash of value that depends on seed.
+
+    The builtin hash of a tuple doesn't mix the hashes of small integers well
+    enough to give independent hashes for different seeds, so the seeded
+    value is mixed with the SplitMix64 finalizer.
+
+    """
+    value = (hash(value) + seed * 0x9e3779b97f4a7c15) & _MASK64
+    value = ((value ^ (value >> 30)) * 0xbf58476d1ce4e5b9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94d049bb133111eb) & _MASK64
+    return value ^ (value >> 31)
+
+
+class BloomFilter(object):
+    """ A probabilistic set of hashable values.
+
+    A value that has been added is always reported as present, but a value
+    that has not been added may also be reported as present with a small
+    probability (a false positive). The filter uses a fixed amount of memory
+    regardless of the number of values added.
+
+    """
+    def __init__(self, capacity, rate):
+        """ Initialize this object.
+
+        The filter is sized so that the false positive rate is rate once
+        capacity values have been added.
+
         """
-        tokens = [format(func(time), fmt) for fmt, func in self._fields]
-        return self._template.format(*tokens)
\ No newline at end of file
+        capacity = max(capacity, 1)
+        size = int(ceil(-capacity * log(rate) / log(2)**2))
+        self._size = max(size, 8)
+        self._count = max(int(round(self._size * log(2) / capacity)), 1)
+        self._bits = bytearray((self._size + 7) // 8)
+        return
+
+    def add(self, value):
+        """ Add a value to the filter.
+
+        Return True if the value was already present.
+
+        """
+        # Double hashing: the positions for each value are h1 + i*h2 for
+        # i = 0..count-1, which is as good as count independent hashes.
+        # The builtin hash maps small integers to themselves, so its bits are
+        # mixed (using the SplitMix64 finalizer) before deriving the two base
+        # hashes from the upper and lower halves.
+        bits = self._bits
+        size = self._size
+        value = hash(value) & _MASK64
+        value = ((value ^ (value >> 30)) * 0xbf58476d1ce4e5b9) & _MASK64
+        value = ((value ^ (value >> 27)) * 0x94d049bb133111eb) & _MASK64
+        value ^= value >> 31
+        pos = (value & 0xffffffff) % size
+        step = (value >> 32) % size or 1
+        present = True
+        for _ in xrange(self._count):
+            byte = pos >> 3
+            mask = 1 << (pos & 7)
+            if not bits[byte] & mask:
+                bits[byte] |= mask
+                present = False
+            pos += step
+            if pos >= size:
+                pos -= size
+        return present
+
+
+def _scan(timefmt, escape):
+    """ Iterate over a time format string while unescaping characters.
+
+    Each item is a character and a flag indicating whether it was escaped.
+
+    """
+    esc = False
+    for char in timefmt:
+        if char == escape and not esc:
+            # An unescaped escape character.
+            esc = True
+        else:
+            # A regular character.
+            yield char, esc
+            esc = False
+    return
+
+
+def _template(parts):
+    """ Return the source code for rendering TimeFormat parts as a string.
+
+    """
+    template = "".join(slot for slot, value, cacheable in parts)
+    values = [value for slot, value, cacheable in parts if value]
+    if not values:
+        return repr(template.replace("%%", "%"))
+    return "{0!r} % ({1:s},)".format(template, ", ".join(values))
@@ -7,9 +7,31 @@ into one record, reorder records, or any combination thereof.
 """
 from __future__ import absolute_import
 
+from collections import deque
+from datetime import datetime
+from datetime import timedelta
+from functools import partial
+from heapq import heapify
+from heapq import heappop
+from heapq import heappush
+from heapq import heapreplace
+from itertools import islice
+from multiprocessing import Pool
+from multiprocessing import cpu_count
+from operator import itemgetter
+from os import close
+from tempfile import mkstemp
+
+from ._compile import _define
+from ._util import BloomFilter
+from ._util import SpillFile
+from ._util import hash64
 from .reader import _Reader
 from .writer import _Writer
 
+__all__ = ("AggregateBuffer", "DedupBuffer", "JoinBuffer", "SortBuffer",
+           "WindowBuffer")
+
 
 class _ReaderBuffer(_Reader):
     """ Abstract base class for all reader buffers.
@@ -27,7 +49,7 @@ class _ReaderBuffer(_Reader):
         """
         super(_ReaderBuffer, self).__init__()
         self._reader = reader
-        self._output = []  # FIFO
+        self._output = deque()  # FIFO
         return
         
     def _get(self):
@@ -41,7 +63,43 @@ class _ReaderBuffer(_Reader):
                 # Underflow condition.
                 self._reader = None
                 self._uflow()  # raises StopIteration on EOF
-        return self._output.pop(0)
+        return self._output.popleft()
+
+    def _get_batch(self, count):
+        """ Return a list of up to count buffered input records.
+
+        """
+        output = self._output
+        while len(output) < count:
+            # Only look up read_batch() here so that an AttributeError from
+            # reading isn't mistaken for a missing method.
+            read_batch = getattr(self._reader, "read_batch", None)
+            if read_batch is not None:
+                records = read_batch(count - len(output))
+            elif self._reader is not None:
+                # A plain iterator.
+                try:
+                    records = [self._reader.next()]
+                except StopIteration:
+                    records = None
+            else:
+                # The reader is exhausted.
+                records = None
+            if not records:
+                # Underflow condition. As with _get(), _uflow() is only called
+                # when the output queue is empty.
+                self._reader = None
+                if output:
+                    break
+                try:
+                    self._uflow()
+                except StopIteration:
+                    break
+                continue
+            for record in records:
+                self._queue(record)
+        popleft = output.popleft
+        return [popleft() for _ in xrange(min(count, len(output)))]
             
     def _queue(self, record):
         """ Process each incoming record.
@@ -79,7 +137,7 @@ class _WriterBuffer(_Writer):
         """
         super(_WriterBuffer, self).__init__()
         self._writer = writer
-        self._output = []  # FIFO
+        self._output = deque()  # FIFO
         return
         
     def dump(self, records):
@@ -104,9 +162,7 @@ class _WriterBuffer(_Writer):
         
         """
         self._flush()
-        for record in self._output:
-            # Base class write() applies filters.
-            super(_WriterBuffer, self).write(record) 
+        self._drain()
         self._output = None
         self._writer = None
         return
@@ -118,12 +174,19 @@ class _WriterBuffer(_Writer):
         # Process this record, then write any new records in the output queue
         # to the destination writer.
         self._queue(record)
-        for record in self._output:
-            # Base class write() applies filters.
-            super(_WriterBuffer, self).write(record) 
-        self._output = []
+        if self._output:
+            self._drain()
         return
-        
+
+    def write_batch(self, records):
+        """ Write a sequence of records to the buffer.
+
+        """
+        for record in records:
+            self._queue(record)
+        self._drain()
+        return
+
     def _put(self, record):
         """ Write this record to the destination writer.
         
@@ -132,6 +195,35 @@ class _WriterBuffer(_Writer):
         self._writer.write(record)
         return
 
+    def _put_batch(self, records):
+        """ Write a sequence of records to the destination writer.
+
+        """
+        # At this point the records have already been buffered and filtered.
+        try:
+            write_batch = self._writer.write_batch
+        except AttributeError:  # not a _Writer
+            super(_WriterBuffer, self)._put_batch(records)
+            return
+        write_batch(records)
+        return
+
+    def _drain(self):
+        """ Write all records in the output queue to the destination writer.
+
+        """
+        output = self._output
+        if len(output) == 1:
+            # Base class write() applies filters.
+            super(_WriterBuffer, self).write(output.popleft())
+        elif output:
+            # Base class write_batch() applies filters to the entire queue and
+            # hands it off to the destination writer in a single call.
+            records = list(output)
+            output.clear()
+            super(_WriterBuffer, self).write_batch(records)
+        return
+
     def _queue(self, record):
         """ Process this record.
         
@@ -151,3 +243,866 @@ class _WriterBuffer(_Writer):
         
         """
         return
+
+
+class SortBuffer(_ReaderBuffer):
+    """ Sort input records by key using a bounded amount of memory.
+
+    Input records are collected into runs of up to limit records. Each run is
+    sorted in memory, and if the input does not fit into a single run the
+    sorted runs are spilled to temporary files and merged once the input
+    reader is exhausted. The sort is stable.
+
+    """
+    fan_in = 64  # maximum number of runs to merge at once
+
+    def __init__(self, reader, key, limit=262144, processes=1):
+        """ Initialize this object.
+
+        The key is a field name or a sequence of field names to sort by. The
+        limit is the maximum number of records in a run. Runs are sorted and
+        spilled in the calling process by default, so at most limit input
+        records are held in memory at once. If processes is greater than 1 (or
+        None for the number of CPUs) runs are sorted by a pool of worker
+        processes while input continues to be read. Up to processes runs can
+        be waiting to be sorted in addition to the current run, so as many as
+        (processes + 1) * limit records can be held in memory. The pool is
+        created when the first run is spilled.
+
+        """
+        super(SortBuffer, self).__init__(reader)
+        if isinstance(key, basestring):
+            key = (key,)
+        self._key = tuple(key)
+        self._limit = max(limit, 1)
+        self._run = []
+        self._runs = []  # SpillFiles or pending worker results
+        self._merged = None
+        self._pool = None
+        self._processes = 1
+        if processes is None or processes > 1:
+            self._processes = processes or cpu_count()
+        return
+
+    def __del__(self):
+        """ Stop any worker processes when this buffer is destroyed.
+
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+        return
+
+    def close(self):
+        """ Release all resources held by this buffer.
+
+        This is called automatically once all records have been read, but it
+        should be called explicitly if the buffer is abandoned before then. No
+        more records can be read after the buffer is closed.
+
+        """
+        self._release()
+        self._merged = iter(())
+        self._output.clear()
+        return
+
+    def _queue(self, record):
+        """ Process each incoming record.
+
+        """
+        self._run.append(record)
+        if len(self._run) >= self._limit:
+            self._spill()
+        return
+
+    def _uflow(self):
+        """ Handle an underflow condition.
+
+        """
+        if self._merged is None:
+            # The input reader is exhausted, so start merging the runs.
+            self._merged = self._merge()
+        self._output.extend(islice(self._merged, SpillFile.chunk_size))
+        if not self._output:
+            raise StopIteration
+        return
+
+    def _spill(self):
+        """ Sort the current run and write it to a temporary file.
+
+        """
+        run = self._run
+        self._run = []
+        if self._processes == 1:
+            run.sort(key=itemgetter(*self._key))
+            spill = SpillFile()
+            spill.write(run)
+            self._runs.append(spill)
+            return
+        pending = [pos for (pos, item) in enumerate(self._runs) if not
+                   isinstance(item, SpillFile)]
+        if len(pending) >= self._processes:
+            # Limit the number of runs waiting to be sorted so that memory
+            # use remains bounded.
+            self._wait(pending[0])
+        if self._pool is None:
+            self._pool = Pool(self._processes)
+        self._runs.append(self._pool.apply_async(_sort_run, (run, self._key)))
+        return
+
+    def _wait(self, pos):
+        """ Wait for a worker process to finish sorting a run.
+
+        """
+        self._runs[pos] = SpillFile(self._runs[pos].get())
+        return
+
+    def _release(self):
+        """ Delete all temporary files and stop any worker processes.
+
+        """
+        for run in self._runs:
+            if not isinstance(run, SpillFile):
+                # Wait for the worker process so its file can be deleted.
+                run = SpillFile(run.get())
+            run.close()
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        self._runs = []
+        self._run = []
+        return
+
+    def _merge(self):
+        """ Iterate over all records in sorted order.
+
+        """
+        key = itemgetter(*self._key)
+        self._run.sort(key=key)
+        if not self._runs:
+            # Everything fit into memory.
+            for record in self._run:
+                yield record
+            self._release()
+            return
+        for pos in range(len(self._runs)):
+            if not isinstance(self._runs[pos], SpillFile):
+                self._wait(pos)
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        runs = self._runs
+        while len(runs) + 1 > self.fan_in:
+            # Merge groups of adjacent runs into longer runs. The runs remain
+            # in input order to keep the sort stable.
+            merged = []
+            for beg in range(0, len(runs), self.fan_in):
+                group = runs[beg:beg+self.fan_in]
+                if len(group) > 1:
+                    spill = SpillFile()
+                    spill.write(_merge_runs(group, key))
+                    for run in group:
+                        run.close()
+                    group = [spill]
+                merged.extend(group)
+            runs = merged
+        self._runs = runs
+        for record in _merge_runs(runs + [self._run], key):
+            yield record
+        self._release()
+        return
+
+
+class AggregateBuffer(_ReaderBuffer):
+    """ Compute aggregate values for each group of input records.
+
+    Records are grouped by key, and one output record is emitted for each
+    group once the input reader is exhausted. Each output record contains the
+    key fields and the aggregate values for the group. Groups are emitted in
+    arbitrary order; use a SortBuffer to order them.
+
+    """
+    partitions = 16  # number of partitions used when spilling to disk
+    depth = 8  # maximum number of times a partition is divided again
+
+    def __init__(self, reader, key, aggregates, limit=1048576):
+        """ Initialize this object.
+
+        The key is a field name or a sequence of field names to group by. The
+        aggregates argument is a sequence of (name, func, field) tuples, where
+        name is the output field, func is "count", "sum", "min", "max",
+        "mean", "first", or "last", and field is the input field. Missing
+        (None) values are ignored except by "first" and "last". The field can
+        be omitted for "count" to count records instead of values.
+
+        The limit is the maximum number of groups held in memory. When it is
+        exceeded, the accumulated values are spilled to disk in partitions by
+        key, and each partition is combined separately once all input has been
+        read. A partition that still has more than limit groups is divided
+        into partitions again using a different hash.
+
+        """
+        super(AggregateBuffer, self).__init__(reader)
+        if isinstance(key, basestring):
+            key = (key,)
+        self._limit = max(limit, 1)
+        self._aggregator = _Aggregator(key, aggregates, limit=self._limit,
+                                       overflow=self._spill)
+        self._table = {}
+        self._spills = None
+        self._groups = None
+        # Each incoming record is processed by the compiled update function
+        # directly; this replaces the _queue() method.
+        self._queue = partial(self._aggregator.update, self._table)
+        return
+
+    def _uflow(self):
+        """ Handle an underflow condition.
+
+        """
+        if self._groups is None:
+            # The input reader is exhausted, so start emitting groups.
+            self._groups = self._emit()
+        self._output.extend(islice(self._groups, SpillFile.chunk_size))
+        if not self._output:
+            raise StopIteration
+        return
+
+    def _spill(self):
+        """ Write the accumulated values for each group to disk.
+
+        """
+        if self._spills is None:
+            self._spills = [SpillFile() for _ in range(self.partitions)]
+        self._partition(self._table.iteritems(), self._spills, 0)
+        self._table.clear()
+        return
+
+    def _partition(self, items, spills, depth):
+        """ Write (key, values) items to partitions by key.
+
+        Each level of partitioning uses a different hash so that a partition
+        can be divided again.
+
+        """
+        partitions = [[] for _ in spills]
+        count = len(partitions)
+        for item in items:
+            hashed = hash64(item[0], depth) if depth else hash(item[0])
+            partitions[hashed % count].append(item)
+        for spill, items in zip(spills, partitions):
+            spill.write(items)
+        return
+
+    def _emit(self):
+        """ Iterate over the output record for each group.
+
+        """
+        result = self._aggregator.result
+        if self._spills is None:
+            # Everything fit into memory.
+            for item in self._table.iteritems():
+                yield result(*item)
+            self._table.clear()
+            return
+        self._spill()
+        merge = self._aggregator.merge
+        table = self._table
+        pending = [(spill, 1) for spill in self._spills]
+        self._spills = None
+        while pending:
+            # Each partition has a disjoint set of keys.
+            spill, depth = pending.pop()
+            items = iter(spill)
+            for key, values in items:
+                try:
+                    merge(table[key], values)
+                    continue
+                except KeyError:  # first occurrence of this key
+                    pass
+                if len(table) >= self._limit and depth <= self.depth:
+                    break
+                table[key] = values
+            else:
+                spill.close()
+                for item in table.iteritems():
+                    yield result(*item)
+                table.clear()
+                continue
+            # There are too many groups in this partition to fit into memory,
+            # so divide it again.
+            spills = [SpillFile() for _ in range(self.partitions)]
+            self._partition(table.iteritems(), spills, depth)
+            table.clear()
+            self._partition([(key, values)], spills, depth)
+            while True:
+                chunk = list(islice(items, SpillFile.chunk_size))
+                if not chunk:
+                    break
+                self._partition(chunk, spills, depth)
+            spill.close()
+            pending.extend((spill, depth + 1) for spill in spills)
+        return
+
+
+class DedupBuffer(_ReaderBuffer):
+    """ Drop input records with duplicate keys.
+
+    Only the key of each record is retained, and the number of keys is
+    bounded. By default duplicates are detected exactly among the most
+    recently seen keys, which works for input that is nearly in order.
+    Alternatively, a bloom filter can detect duplicates anywhere in the input
+    in a fixed amount of memory, at the cost of occasionally dropping a unique
+    record.
+
+    """
+    def __init__(self, reader, key, limit=1048576, window=None, rate=None):
+        """ Initialize this object.
+
+        The key is a field name or a sequence of field names that identify
+        duplicate records; the first record with each key is passed through.
+
+        In exact mode (the default), the limit is the maximum number of keys
+        to retain; the least recently seen keys are discarded first. The
+        optional window is a (field, span) pair, e.g. ("time",
+        timedelta(hours=1)), and keys are also discarded once the field value
+        of the latest record is more than span past the field value of the
+        record where the key was last seen.
+
+        If rate is given, a bloom filter is used that is sized for limit keys
+        with a false positive rate of rate, and window is ignored. The actual
+        false positive rate increases if there are more than limit keys.
+
+        """
+        super(DedupBuffer, self).__init__(reader)
+        if isinstance(key, basestring):
+            key = (key,)
+        self._key = itemgetter(*key)
+        if rate is not None:
+            self._bloom = BloomFilter(limit, rate)
+            self._queue = self._queue_bloom
+            return
+        self._limit = max(limit, 1)
+        self._seen = {}  # key -> sequence number when last seen
+        self._recent = deque()  # (sequence number, key, window value)
+        self._seq = 0
+        self._window = window
+        return
+
+    def _queue(self, record):
+        """ Process each incoming record in exact mode.
+
+        """
+        key = self._key(record)
+        value = None
+        if self._window is not None:
+            value = record[self._window[0]]
+            self._expire(value - self._window[1])
+        unique = key not in self._seen
+        self._seq += 1
+        self._seen[key] = self._seq
+        self._recent.append((self._seq, key, value))
+        if len(self._recent) > self._limit:
+            self._evict()
+        if unique:
+            self._output.append(record)
+        return
+
+    def _queue_bloom(self, record):
+        """ Process each incoming record in bloom filter mode.
+
+        """
+        if not self._bloom.add(self._key(record)):
+            self._output.append(record)
+        return
+
+    def _evict(self):
+        """ Discard the least recently seen keys.
+
+        """
+        # A key is in the deque once for every time it was seen, and only its
+        # last entry is current. Stale entries are discarded along the way,
+        # and if they take up too much space the deque is compacted.
+        recent = self._recent
+        seen = self._seen
+        while len(seen) > self._limit:
+            seq, key, _ = recent.popleft()
+            if seen.get(key) == seq:
+                del seen[key]
+        if len(recent) > 2 * self._limit:
+            self._recent = deque(item for item in recent if
+                                 seen.get(item[1]) == item[0])
+        return
+
+    def _expire(self, cutoff):
+        """ Discard keys that were last seen before the window cutoff.
+
+        """
+        recent = self._recent
+        seen = self._seen
+        while recent and recent[0][2] < cutoff:
+            seq, key, _ = recent.popleft()
+            if seen.get(key) == seq:
+                del seen[key]
+        return
+
+
+class JoinBuffer(_ReaderBuffer):
+    """ Join input records with records from another reader.
+
+    The records from the build reader are loaded into a hash table by key,
+    and each input record is looked up in the table as it is read. If the
+    build reader has too many records to hold in memory, both sides of the
+    join are partitioned to disk by key and each partition is joined once the
+    input reader is exhausted (a grace hash join); in this case output records
+    are not in input order.
+
+    """
+    partitions = 16  # number of partitions used when spilling to disk
+
+    def __init__(self, reader, build, key, how="inner", limit=1048576):
+        """ Initialize this object.
+
+        The build reader is read in its entirety when the buffer is created;
+        it should be the smaller side of the join. The key is a field name or
+        a sequence of field names common to both sides. For an "inner" join
+        each input record is combined with every build record with the same
+        key; input records with no match are dropped. A "left" join also
+        passes through input records that have no match, and an "anti" join
+        passes through only the input records that have no match. Input
+        record fields take precedence over build record fields. The limit is
+        the maximum number of build records held in memory.
+
+        """
+        super(JoinBuffer, self).__init__(reader)
+        if how not in ("inner", "left", "anti"):
+            raise ValueError("unknown join: {0:s}".format(how))
+        if isinstance(key, basestring):
+            key = (key,)
+        self._key = itemgetter(*key)
+        self._how = how
+        self._table = {}
+        self._builds = None  # build side partitions
+        self._probes = None  # input side partitions
+        self._pending = None  # records waiting to be written to a partition
+        self._joins = None
+        count = 0
+        for record in build:
+            if self._builds is not None:
+                self._partition(self._builds, record)
+                continue
+            try:
+                self._table[self._key(record)].append(record)
+            except KeyError:  # first record with this key
+                self._table[self._key(record)] = [record]
+            count += 1
+            if count > limit:
+                # Switch to a grace hash join.
+                self._builds = self._spill(self._table.itervalues())
+                self._table = None
+        if self._builds is not None:
+            self._flush(self._builds)
+            self._probes = self._spill(())
+        return
+
+    def _queue(self, record):
+        """ Process each incoming record.
+
+        """
+        if self._probes is not None:
+            self._partition(self._probes, record)
+        else:
+            self._probe(record, self._table)
+        return
+
+    def _uflow(self):
+        """ Handle an underflow condition.
+
+        """
+        if self._probes is None:
+            raise StopIteration
+        if self._joins is None:
+            # The input reader is exhausted, so join each partition.
+            self._flush(self._probes)
+            self._joins = self._join()
+        for record in self._joins:
+            self._probe(record, self._table)
+            if len(self._output) >= SpillFile.chunk_size:
+                break
+        else:
+            self._probes = None
+            if not self._output:
+                raise StopIteration
+        return
+
+    def _probe(self, record, table):
+        """ Queue the output for an input record.
+
+        """
+        matches = table.get(self._key(record))
+        if matches is None:
+            if self._how != "inner":
+                self._output.append(record)
+            return
+        if self._how == "anti":
+            return
+        for match in matches:
+            joined = match.copy()
+            joined.update(record)
+            self._output.append(joined)
+        return
+
+    def _spill(self, groups):
+        """ Return a list of partitions containing groups of records.
+
+        """
+        spills = [SpillFile() for _ in range(self.partitions)]
+        self._pending = dict((spill, []) for spill in spills)
+        for records in groups:
+            for record in records:
+                self._partition(spills, record)
+        return spills
+
+    def _partition(self, spills, record):
+        """ Add a record to its partition.
+
+        """
+        spill = spills[hash(self._key(record)) % len(spills)]
+        pending = self._pending[spill]
+        pending.append(record)
+        if len(pending) >= SpillFile.chunk_size:
+            spill.write(pending)
+            del pending[:]
+        return
+
+    def _flush(self, spills):
+        """ Write all pending records to their partitions.
+
+        """
+        for spill in spills:
+            spill.write(self._pending.pop(spill))
+        return
+
+    def _join(self):
+        """ Iterate over the input records in each partition.
+
+        The build side of the partition is loaded into the hash table before
+        its input records are returned.
+
+        """
+        for build, probe in zip(self._builds, self._probes):
+            self._table = {}
+            for record in build:
+                try:
+                    self._table[self._key(record)].append(record)
+                except KeyError:  # first record with this key
+                    self._table[self._key(record)] = [record]
+            build.close()
+            for record in probe:
+                yield record
+            probe.close()
+        self._table = {}
+        self._builds = None
+        return
+
+
+class WindowBuffer(_ReaderBuffer):
+    """ Compute aggregate values for time windows of input records.
+
+    Records are assigned to windows by the value of a datetime field, and are
+    optionally grouped by key within each window. One output record is
+    emitted for each group in a window as soon as the window is closed, so
+    only the open windows are held in memory. A window is closed when its end
+    is earlier than the watermark, which is the latest time seen so far minus
+    the allowed lateness. Records for windows that have already been closed
+    are dropped.
+
+    """
+    def __init__(self, reader, time, size, aggregates, key=None, step=None,
+                 lateness=None, origin=None):
+        """ Initialize this object.
+
+        The time argument is the name of the datetime field, and size is the
+        window length as a timedelta. By default windows are tumbling, i.e.
+        they do not overlap. If step is given, a new window starts every step
+        and windows overlap if step is less than size (sliding windows).
+        Windows are aligned to origin, which defaults to midnight on January
+        1, 1970.
+
+        The aggregates argument is as described for AggregateBuffer, and key is
+        an optional field name or sequence of field names to group by within
+        each window. Each output record contains the key fields, the
+        aggregate values, and the time field, which is set to the start of the
+        window. Windows are emitted in order.
+
+        The lateness is the maximum timedelta by which a record may be out of
+        order and still be counted in its windows; the default is zero.
+
+        """
+        super(WindowBuffer, self).__init__(reader)
+        if key is None:
+            key = ()
+        elif isinstance(key, basestring):
+            key = (key,)
+        self._aggregator = _Aggregator(key, aggregates)
+        self._time = time
+        self._size = _micros(size)
+        self._step = self._size if step is None else _micros(step)
+        self._lateness = 0 if lateness is None else _micros(lateness)
+        self._origin = datetime(1970, 1, 1) if origin is None else origin
+        self._tables = {}  # open windows by index
+        self._open = []  # heap of open window indexes
+        self._started = False  # True once a record has been seen
+        self._closed = 0  # index of first window that is not closed
+        self._latest = 0  # latest record time
+        return
+
+    def _queue(self, record):
+        """ Process each incoming record.
+
+        """
+        time = record[self._time]
+        if time is None:
+            return
+        time = _micros(time - self._origin)
+        last = time // self._step  # last window containing this record
+        first = (time - self._size) // self._step + 1
+        if not self._started:
+            # The first record sets the initial watermark.
+            self._started = True
+            self._latest = time
+            self._closed = (time - self._lateness - self._size) // \
+                           self._step + 1
+        update = self._aggregator.update
+        tables = self._tables
+        for pos in xrange(max(first, self._closed), last + 1):
+            try:
+                table = tables[pos]
+            except KeyError:  # new window
+                table = tables[pos] = {}
+                heappush(self._open, pos)
+            update(table, record)
+        if time > self._latest:
+            # Advance the watermark and close any windows that end before it.
+            self._latest = time
+            watermark = time - self._lateness
+            while self._open and \
+                    self._open[0] * self._step + self._size <= watermark:
+                self._close(heappop(self._open))
+            self._closed = max(self._closed,
+                               (watermark - self._size) // self._step + 1)
+        return
+
+    def _uflow(self):
+        """ Handle an underflow condition.
+
+        """
+        if not self._open:
+            raise StopIteration
+        # The input reader is exhausted, so close the remaining windows.
+        while self._open:
+            self._close(heappop(self._open))
+        return
+
+    def _close(self, pos):
+        """ Emit the records for a window.
+
+        """
+        start = self._origin + timedelta(microseconds=pos*self._step)
+        result = self._aggregator.result
+        for item in self._tables.pop(pos).iteritems():
+            record = result(*item)
+            record[self._time] = start
+            self._output.append(record)
+        return
+
+
+# Sentinel for an accumulator that has not been assigned a value yet.
+
+_MISSING = object()
+
+
+class _Aggregator(object):
+    """ Accumulate aggregate values for groups of records.
+
+    The accumulated values for each group are kept in a flat list, and the
+    functions that operate on them are compiled for a specific set of
+    aggregates.
+
+    """
+    # For each aggregate function, the initial accumulator values, whether
+    # missing values are ignored, and the source code for updating the
+    # accumulators with a value, combining them with the accumulators b of
+    # another group, and computing the result. Within the source code {0:d} is
+    # the position of the first accumulator value and {v:s} is the value.
+    _funcs = {
+        "count": (
+            (0,), True,
+            "a[{0:d}] += 1",
+            "a[{0:d}] += b[{0:d}]",
+            "a[{0:d}]"),
+        "sum": (
+            (0,), True,
+            "a[{0:d}] += {v:s}",
+            "a[{0:d}] += b[{0:d}]",
+            "a[{0:d}]"),
+        "min": (
+            (None,), True,
+            "if {v:s} < a[{0:d}] or a[{0:d}] is None: a[{0:d}] = {v:s}",
+            "if b[{0:d}] is not None and (a[{0:d}] is None or b[{0:d}] < "
+            "a[{0:d}]): a[{0:d}] = b[{0:d}]",
+            "a[{0:d}]"),
+        "max": (
+            (None,), True,
+            "if {v:s} > a[{0:d}]: a[{0:d}] = {v:s}",  # None is less than all
+            "if b[{0:d}] > a[{0:d}]: a[{0:d}] = b[{0:d}]",
+            "a[{0:d}]"),
+        "mean": (
+            (0, 0), True,
+            "a[{0:d}] += {v:s}; a[{1:d}] += 1",
+            "a[{0:d}] += b[{0:d}]; a[{1:d}] += b[{1:d}]",
+            "float(a[{0:d}]) / a[{1:d}] if a[{1:d}] else None"),
+        "first": (
+            (_MISSING,), False,
+            "if a[{0:d}] is MISSING: a[{0:d}] = {v:s}",
+            "",  # earlier groups are always combined first
+            "a[{0:d}]"),
+        "last": (
+            (None,), False,
+            "a[{0:d}] = {v:s}",
+            "a[{0:d}] = b[{0:d}]",
+            "a[{0:d}]")}
+
+    def __init__(self, key, aggregates, limit=None, overflow=None):
+        """ Initialize this object.
+
+        The key is a sequence of field names, and aggregates is a sequence of
+        (name, func, field) tuples as described for AggregateBuffer. The
+        compiled update(table, record) function adds a record to its group in
+        table, a dict of accumulators by key. If limit is not None, the
+        overflow callback is called before a new group is added to a table
+        that already has limit groups; it must remove the groups from the
+        table.
+
+        """
+        namespace = {"MISSING": _MISSING, "init": [], "overflow": overflow,
+                     "limit": limit}
+        initial = namespace["init"]
+        fields = []  # field names in order of first use
+        guarded = {}  # updates that ignore missing values by field
+        keys = []
+        values = []
+        for pos, name in enumerate(key):
+            namespace["k{0:d}".format(pos)] = name
+            keys.append("record[{0!r}]".format(name))
+            value = "k" if len(key) == 1 else "k[{0:d}]".format(pos)
+            values.append("k{0:d}: {1:s}".format(pos, value))
+        update = [
+            "def update(table, record):",
+            "    k = {0:s}".format(keys[0] if len(keys) == 1 else
+                                   "({0:s})".format(", ".join(keys))),
+            "    a = table.get(k)",
+            "    if a is None:"]
+        if limit is not None:
+            update.extend([
+                "        if len(table) >= limit:",
+                "            overflow()"])
+        update.append("        a = table[k] = init[:]")
+        merge = ["def merge(a, b):"]
+        result = ["def result(k, a):"]
+        for pos, spec in enumerate(aggregates):
+            try:
+                name, func, field = spec
+            except ValueError:  # count records
+                (name, func), field = spec, None
+            try:
+                init, guard, update_src, merge_src, result_src = \
+                    self._funcs[func]
+            except KeyError:
+                raise ValueError("unknown aggregate: {0:s}".format(func))
+            slots = range(len(initial), len(initial) + len(init))
+            initial.extend(init)
+            if field is None:
+                # Every record counts, so there is no value to check.
+                update.append("    " + update_src.format(*slots))
+            else:
+                if field not in fields:
+                    # Read each field once.
+                    value = "v{0:d}".format(len(fields))
+                    update.append("    {0:s} = record[{1!r}]".format(value,
+                                                                   field))
+                    guarded[field] = []
+                    fields.append(field)
+                value = "v{0:d}".format(fields.index(field))
+                src = update_src.format(*slots, v=value)
+                if guard:
+                    guarded[field].append(src)
+                else:
+                    update.append("    " + src)
+            if merge_src:
+                merge.append("    " + merge_src.format(*slots))
+            namespace["n{0:d}".format(pos)] = name
+            value = result_src.format(*slots)
+            values.append("n{0:d}: {1:s}".format(pos, value))
+        for pos, field in enumerate(fields):
+            # Check each value for None once.
+            if guarded[field]:
+                update.append("    if v{0:d} is not None:".format(pos))
+                update.extend("        " + src for src in guarded[field])
+        update.append("    return")
+        merge.append("    return")
+        result.append("    return {{{0:s}}}".format(", ".join(values)))
+        self.update = _define("update", update, namespace)
+        self.merge = _define("merge", merge, namespace)
+        self.result = _define("result", result, namespace)
+        return
+
+
+def _merge_runs(runs, key):
+    """ Iterate over the records in a sequence of sorted runs in order.
+
+    Ties are broken by run position, so the merge is stable.
+
+    """
+    heap = []
+    for pos, run in enumerate(runs):
+        records = iter(run)
+        for record in records:
+            heap.append((key(record), pos, record, records))
+            break
+    heapify(heap)
+    while heap:
+        item = heap[0]
+        yield item[2]
+        records = item[3]
+        for record in records:
+            heapreplace(heap, (key(record), item[1], record, records))
+            break
+        else:
+            # This run is exhausted.
+            heappop(heap)
+    return
+
+
+def _sort_run(run, key):
+    """ Sort a run and write it to a temporary file.
+
+    This is executed by a SortBuffer worker process. The path of the file is
+    returned.
+
+    """
+    run.sort(key=itemgetter(*key))
+    fd, path = mkstemp()
+    close(fd)
+    spill = SpillFile(path)
+    spill.write(run)
+    spill.close(delete=False)
+    return path
+
+
+def _micros(delta):
+    """ Return a timedelta as an integer number of microseconds.
+
+    """
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
@@ -11,10 +11,11 @@ from itertools import product
 
 from ._util import Field
 from ._util import TimeFormat
+from ._util import TimeParser
 
 
-__all__ = ("ConstType", "IntType", "FloatType", "StringType", "DatetimeType",
-           "ArrayType")
+__all__ = ("ConstType", "IntType", "FloatType", "StringType",
+           "CategoricalType", "DatetimeType", "ArrayType", "CachedType")
 
 
 class _DataType(object):
@@ -134,6 +135,83 @@ class StringType(_DataType):
         return "{0:s}{1:s}{0:s}".format(self._quote, format(value, self._fmt))
 
 
+class CategoricalType(StringType):
+    """ A string value that is decoded as an integer category code.
+
+    Each distinct string is assigned a code the first time it is decoded, and
+    the strings are stored once in the categories list for this object. This
+    reduces the memory used by records with many repeated strings. Codes are
+    only meaningful for the object that assigned them, so the same object
+    should be used for reading and writing a field, and it should not be used
+    with a ParallelReader unless all categories are specified in advance.
+
+    Decoded records hold the int codes themselves, not strings. Anything that
+    needs the string, e.g. a writer that uses a StringType for this field or a
+    sort key that should be in string order, must convert the code with
+    value() first. This object's own encode() accepts codes directly.
+
+    """
+    def __init__(self, fmt="s", quote="", default=None, categories=()):
+        """ Initialize this object.
+
+        The optional categories argument is a sequence of strings to assign
+        codes to in order.
+
+        """
+        super(CategoricalType, self).__init__(fmt, quote, default)
+        self.categories = []
+        self._codes = {}
+        for value in categories:
+            self.code(value)
+        return
+
+    def code(self, value):
+        """ Return the code for a string, assigning a new code if necessary.
+
+        """
+        try:
+            return self._codes[value]
+        except KeyError:  # new category
+            pass
+        code = self._codes[value] = len(self.categories)
+        self.categories.append(value)
+        return code
+
+    def value(self, code):
+        """ Return the string for a code.
+
+        A code of None is returned as None.
+
+        """
+        return None if code is None else self.categories[code]
+
+    def decode(self, token):
+        """ Convert a text token to a category code.
+
+        A blank token is decoded as the code for the default value, or None if
+        there is no default.
+
+        """
+        value = token.strip().strip(self._quote) or self._default
+        if value is None:
+            return None
+        try:
+            return self._codes[value]
+        except KeyError:  # new category
+            return self.code(value)
+
+    def encode(self, value):
+        """ Convert a category code or a string to a text token.
+
+        If value is None the default value for this field is used. A default
+        value of None is encoded as a blank string (with quoting if enabled).
+
+        """
+        if isinstance(value, (int, long)) and not isinstance(value, bool):
+            value = self.categories[value]
+        return super(CategoricalType, self).encode(value)
+
+
 class DatetimeType(_DataType):
     """ A datetime value.
 
@@ -148,8 +226,9 @@ class DatetimeType(_DataType):
         """
         super(DatetimeType, self).__init__(datetime, "s", default)
         self._fmtstr = timefmt
-        self._fmtobj = TimeFormat(timefmt)
         self._prec = min(max(prec, 0), 6)  # max precision is microseconds
+        self._format = TimeFormat(timefmt, self._prec or 6).format
+        self._parse = TimeParser(timefmt).parse
         return
 
     def decode(self, token):
@@ -159,7 +238,7 @@ class DatetimeType(_DataType):
         token = token.strip()
         if not token:
             return self._default
-        return datetime.strptime(token, self._fmtstr)
+        return self._parse(token)
 
     def encode(self, value):
         """ Convert a datetime to a text token.
@@ -171,11 +250,7 @@ class DatetimeType(_DataType):
         value = value or self._default
         if value is None:
             return ""
-        token = self._fmtobj(value)
-        if (self._prec > 0):
-            time, usecs = token.split(".")
-            token = "{0:s}.{1:s}".format(time, usecs[0:self._prec])
-        return token
+        return self._format(value)
 
 
 class ArrayType(_DataType):
@@ -237,3 +312,135 @@ class ArrayType(_DataType):
         self.width = len(value_array) * self._stride
         return [field.dtype.encode(elem.get(field.name)) for elem, field in
                 product(value_array, self._fields)]
+
+
+class CachedType(_DataType):
+    """ A memoizing wrapper for a scalar _DataType.
+
+    This is useful for fields that have only a few distinct values, e.g. station
+    IDs or status codes. Decoded values and encoded tokens are stored in a
+    bounded cache so that repeated tokens and values are only converted once,
+    and equal decoded strings share a single object. The cache is disabled if
+    its hit rate is too low to pay for the lookups.
+
+    """
+    _sample = 4096  # lookups to make before checking the hit rate
+
+    def __init__(self, dtype, size=1024, rate=0.5):
+        """ Initialize this object.
+
+        The dtype argument is the _DataType to wrap; an ArrayType is not
+        supported. Each cache holds up to two generations of size items, with
+        recently used items promoted to the current generation. The cache for
+        each direction is disabled once its hit rate is less than rate.
+
+        """
+        super(CachedType, self).__init__(dtype._dtype, dtype._fmt,
+                                         dtype._default)
+        self._type = dtype
+        self._size = size
+        self._rate = rate
+        self._decoded = ({}, {})  # current and old generations
+        self._encoded = ({}, {})
+        self._strings = {}
+        self._decoding = self._encoding = True  # caches are enabled
+        self.decode_hits = self.decode_misses = 0
+        self.encode_hits = self.encode_misses = 0
+        return
+
+    def decode(self, token):
+        """ Convert a text token to a Python value.
+
+        """
+        # Compiled readers and writers keep a reference to this method, so it
+        # checks a flag rather than being replaced when the cache is disabled.
+        if not self._decoding:
+            return self._type.decode(token)
+        try:
+            value = self._decoded[0][token]
+        except KeyError:  # not in the current generation
+            return self._decode_miss(token)
+        self.decode_hits += 1
+        return value
+
+    def encode(self, value):
+        """ Convert a Python value to a text token.
+
+        """
+        if not self._encoding:
+            return self._type.encode(value)
+        # Equal values of different types, e.g. 1, 1.0, and True, can encode
+        # differently, so the type is part of the key.
+        key = (type(value), value)
+        try:
+            token = self._encoded[0][key]
+        except KeyError:  # not in the current generation
+            return self._encode_miss(key)
+        except TypeError:  # unhashable
+            return self._type.encode(value)
+        self.encode_hits += 1
+        return token
+
+    def _decode_miss(self, token):
+        """ Decode a token that is not in the current generation.
+
+        """
+        try:
+            value = self._decoded[1].pop(token)
+        except KeyError:  # not cached
+            value = self._type.decode(token)
+            if type(value) is str:
+                if len(self._strings) >= self._size:
+                    self._strings.clear()
+                value = self._strings.setdefault(value, value)
+            self.decode_misses += 1
+            if self._disable(self.decode_hits, self.decode_misses):
+                self._decoding = False
+                self._decoded = ({}, {})
+                self._strings.clear()
+                return value
+        else:
+            self.decode_hits += 1
+        self._decoded = self._store(self._decoded, token, value)
+        return value
+
+    def _encode_miss(self, key):
+        """ Encode a value that is not in the current generation.
+
+        The key is the (type, value) pair used by encode().
+
+        """
+        try:
+            token = self._encoded[1].pop(key)
+        except KeyError:  # not cached
+            token = self._type.encode(key[1])
+            self.encode_misses += 1
+            if self._disable(self.encode_hits, self.encode_misses):
+                self._encoding = False
+                self._encoded = ({}, {})
+                return token
+        else:
+            self.encode_hits += 1
+        self._encoded = self._store(self._encoded, key, token)
+        return token
+
+    def _store(self, cache, key, item):
+        """ Add an item to the current generation of a cache.
+
+        The (possibly new) cache is returned. When the current generation is
+        full it becomes the old generation, and the old one is discarded.
+
+        """
+        current, old = cache
+        if len(current) >= self._size:
+            current, old = {}, current
+            cache = (current, old)
+        current[key] = item
+        return cache
+
+    def _disable(self, hits, misses):
+        """ Return True if a cache should be disabled.
+
+        """
+        return hits + misses >= self._sample and hits < self._rate * (hits +
+                                                                      misses)
@@ -0,0 +1,509 @@
+""" Random-access indexes for compressed files.
+
+"""
+from __future__ import absolute_import
+
+from bisect import bisect_right
+from collections import namedtuple
+from struct import Struct
+from zlib import compress
+from zlib import decompress
+from zlib import decompressobj
+from zlib import error as ZlibError
+from zlib import MAX_WBITS
+
+__all__ = ("GzipIndex",)
+
+
+_WINDOW_SIZE = 32768  # maximum deflate back-reference distance
+_MAGIC = "GZIDX\x01"
+_HEADER = Struct("<QQI")  # size, lines, number of points
+_POINT = Struct("<QBQQI")  # compressed, bits, offset, line, window size
+
+
+class _Point(namedtuple("_Point", "compressed bits offset line window")):
+    """ A position in a gzip file where decompression can be resumed.
+
+    The compressed and bits attributes are the byte offset and bit offset of
+    the start of a deflate block in the file. The offset and line attributes
+    are the number of bytes and lines of uncompressed data that precede the
+    block. The window is the last 32 KB of uncompressed data before the block.
+
+    """
+    __slots__ = ()
+
+
+class GzipIndex(object):
+    """ A random-access index for a gzip file.
+
+    The index stores the state needed to resume decompression at points about
+    span bytes of uncompressed data apart. Starting from the nearest point
+    only requires decompressing at most span bytes to reach any line or byte
+    offset. A GzippedIStream can use an index to start reading in the middle
+    of a file (see GzippedIStream).
+
+    The index for an existing file is created with build() and can be saved
+    to a sidecar file for later use. Only the windows are compressed, so the
+    size of an index is roughly 10-20 KB per point.
+
+    """
+    span = 16777216  # default spacing between points in uncompressed bytes
+
+    @classmethod
+    def build(cls, expr, span=None):
+        """ Create an index for a gzip file.
+
+        The expr argument is a path or a seekable stream opened in binary
+        mode. This requires decompressing the entire file. Points are located
+        at the beginning of each gzip member and at deflate blocks with
+        dynamic Huffman codes, which are used for nearly all compressed text.
+
+        """
+        try:
+            stream = open(expr, "rb")
+        except TypeError:  # not a string
+            return cls(*_Scanner(expr, span or cls.span).scan())
+        with stream:
+            return cls(*_Scanner(stream, span or cls.span).scan())
+
+    @classmethod
+    def load(cls, expr):
+        """ Load an index that was written by save().
+
+        The expr argument is a path or a stream opened in binary mode.
+
+        """
+        try:
+            stream = open(expr, "rb")
+        except TypeError:  # not a string
+            return cls._read(expr)
+        with stream:
+            return cls._read(stream)
+
+    def __init__(self, points, size, lines):
+        """ Initialize this object.
+
+        This is not normally called directly; use build() or load() instead.
+
+        """
+        self._points = list(points)
+        self._offsets = [point.offset for point in self._points]
+        self._lines = [point.line for point in self._points]
+        self.size = size  # total uncompressed bytes
+        self.lines = lines  # total lines
+        return
+
+    def __len__(self):
+        """ Return the number of points in the index.
+
+        """
+        return len(self._points)
+
+    def save(self, expr):
+        """ Save the index.
+
+        The expr argument is a path or a stream opened in binary mode.
+
+        """
+        try:
+            stream = open(expr, "wb")
+        except TypeError:  # not a string
+            self._write(expr)
+        else:
+            with stream:
+                self._write(stream)
+        return
+
+    def locate(self, offset=None, line=None):
+        """ Return the point to start from to reach a byte offset or line.
+
+        The return value is None if reading must begin at the start of the
+        file. Only one of offset or line should be specified.
+
+        """
+        if line is not None:
+            # A point can be in the middle of a line, so the point must be
+            # strictly before the line.
+            pos = bisect_right(self._lines, line - 1)
+        else:
+            pos = bisect_right(self._offsets, offset or 0)
+        return self._points[pos - 1] if pos else None
+
+    @classmethod
+    def _read(cls, stream):
+        """ Read a saved index from a stream.
+
+        """
+        if stream.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError("invalid gzip index")
+        size, lines, count = _HEADER.unpack(stream.read(_HEADER.size))
+        points = []
+        for _ in xrange(count):
+            fields = _POINT.unpack(stream.read(_POINT.size))
+            window = decompress(stream.read(fields[-1]))
+            points.append(_Point(*(fields[:-1] + (window,))))
+        return cls(points, size, lines)
+
+    def _write(self, stream):
+        """ Write the index to a stream.
+
+        """
+        stream.write(_MAGIC)
+        stream.write(_HEADER.pack(self.size, self.lines, len(self._points)))
+        for point in self._points:
+            window = compress(point.window)
+            stream.write(_POINT.pack(*(point[:-1] + (len(window),))))
+            stream.write(window)
+        return
+
+
+class _Resume(object):
+    """ A decompressor that resumes a gzip member at an index point.
+
+    Python's zlib module can't set the bit position or window of a
+    decompressor directly, so the decompressor is primed with a synthetic
+    deflate stream instead: a stored block containing the window, followed by
+    empty blocks that make the synthetic stream end at the same bit position
+    as the point. The last partial byte of the synthetic stream is merged
+    with the first byte of the compressed data, so the rest of the file can
+    be decompressed as is.
+
+    This follows the decompressor protocol used by GzippedIStream. At the end
+    of the member the gzip trailer is discarded, and any data following it is
+    available as unused_data.
+
+    """
+    def __init__(self, point, skip=0):
+        """ Initialize this object.
+
+        The compressed data passed to decompress() must start at the point's
+        byte offset. The first skip bytes of uncompressed data are discarded.
+
+        """
+        self._decoder = decompressobj(-MAX_WBITS)  # raw deflate data
+        self._prefix, self._partial = _prefix(point.window, point.bits)
+        self._skip = len(point.window) + skip
+        self._trailer = 8  # bytes of gzip trailer left to discard
+        self.unused_data = ""
+        return
+
+    def decompress(self, data):
+        """ Return the decompressed data for the next block of input.
+
+        """
+        if self._prefix is not None:
+            # Merge the synthetic stream with the first byte of input.
+            value, bits = self._partial
+            if bits and data:
+                mask = (1 << bits) - 1
+                data = chr(value & mask | ord(data[0]) & ~mask) + data[1:]
+            data = self._prefix + data
+            self._prefix = None
+        if not self._trailer:
+            raise EOFError("end of member")
+        if self._decoder is not None:
+            text = self._decoder.decompress(data)
+            if self._skip:
+                skip = min(self._skip, len(text))
+                text = text[skip:]
+                self._skip -= skip
+            data = self._decoder.unused_data
+            if not data:
+                return text
+            self._decoder = None  # end of deflate data
+        else:
+            text = ""
+        skip = min(self._trailer, len(data))
+        self._trailer -= skip
+        self.unused_data = data[skip:]
+        return text
+
+
+class _Bits(object):
+    """ Write a sequence of bits in deflate order.
+
+    """
+    def __init__(self):
+        """ Initialize this object.
+
+        """
+        self._value = 0
+        self.count = 0
+        return
+
+    def write(self, value, count):
+        """ Write an integer value using count bits, least significant first.
+
+        """
+        self._value |= value << self.count
+        self.count += count
+        return
+
+    def value(self):
+        """ Return the bits as a (data, partial) pair.
+
+        The partial byte is a (value, bits) pair for any bits after the last
+        complete byte.
+
+        """
+        data = []
+        value = self._value
+        for _ in xrange(self.count // 8):
+            data.append(chr(value & 0xff))
+            value >>= 8
+        return "".join(data), (value, self.count % 8)
+
+
+def _prefix(window, bits):
+    """ Return a synthetic deflate stream that primes a decompressor.
+
+    The stream contains the window and ends at the given bit position. The
+    return value is a (data, partial) pair (see _Bits).
+
+    """
+    data = []
+    if window:
+        # A non-final stored block; the header is padded to a byte boundary.
+        size = len(window)
+        data.append("\x00" + chr(size & 0xff) + chr(size >> 8))
+        size ^= 0xffff
+        data.append(chr(size & 0xff) + chr(size >> 8))
+        data.append(window)
+    stream = _Bits()
+    if bits % 2:
+        # A dynamic block is 93 bits long; see _dynamic_block().
+        _dynamic_block(stream)
+    while stream.count % 8 != bits:
+        # Each empty fixed block is 10 bits long.
+        stream.write(0b010, 3)  # non-final fixed block header
+        stream.write(0, 7)  # end-of-block code
+    partial = stream.value()
+    data.append(partial[0])
+    return "".join(data), partial[1]
+
+
+def _dynamic_block(stream):
+    """ Write an empty non-final block with dynamic Huffman codes.
+
+    The literal/length code only contains the end-of-block code, which is
+    allowed for a single code of length 1.
+
+    """
+    stream.write(0b100, 3)  # non-final dynamic block header
+    stream.write(0, 5)  # 257 literal/length codes
+    stream.write(0, 5)  # 1 distance code
+    stream.write(15, 4)  # 19 code length codes
+    for symbol in (16, 17, 18, 0, 8, 7, 9, 6, 10, 5, 11, 4, 12, 3, 13, 2, 14,
+                   1, 15):
+        # Code length symbols 1 and 18 have 1-bit codes 0 and 1.
+        stream.write(1 if symbol in (1, 18) else 0, 3)
+    stream.write(1, 1)  # 18: repeat 0 ...
+    stream.write(138 - 11, 7)  # ... for 138 codes
+    stream.write(1, 1)  # 18: repeat 0 ...
+    stream.write(118 - 11, 7)  # ... for 118 codes
+    stream.write(0, 1)  # 1: end-of-block code length
+    stream.write(0, 1)  # 1: distance code length
+    stream.write(0, 1)  # end-of-block code
+    return
+
+
+class _Window(object):
+    """ The most recent uncompressed data.
+
+    """
+    def __init__(self):
+        """ Initialize this object.
+
+        """
+        self._blocks = []
+        self._size = 0
+        return
+
+    def append(self, data):
+        """ Add data to the window.
+
+        """
+        self._blocks.append(data)
+        self._size += len(data)
+        if self._size >= 4 * _WINDOW_SIZE:
+            self.value()
+        return
+
+    def value(self):
+        """ Return the current window.
+
+        """
+        data = "".join(self._blocks)[-_WINDOW_SIZE:]
+        self._blocks = [data]
+        self._size = len(data)
+        return data
+
+
+class _Scanner(object):
+    """ Find the index points for a gzip file.
+
+    Python's zlib module doesn't report deflate block boundaries, so they are
+    detected indirectly. Input is normally decompressed in large chunks, but
+    when the next point is due it's fed one byte at a time. The header of a
+    block with dynamic Huffman codes is long enough that it produces a run of
+    input bytes with no output, and the boundary must be within a few bytes
+    of the start of the run. Each candidate bit position is tested by
+    resuming decompression there and comparing the output with the actual
+    output.
+
+    """
+    chunk_size = 65536
+    run_size = 8  # zero-output bytes that signal a block header
+    scan_limit = 1048576  # maximum bytes to search for a block boundary
+
+    def __init__(self, stream, span):
+        """ Initialize this object.
+
+        """
+        self._stream = stream
+        self._span = span
+        self._points = []
+        self._offset = 0  # uncompressed bytes
+        self._lines = 0
+        self._window = _Window()
+        self._next = 0  # uncompressed offset for the next point
+        return
+
+    def scan(self):
+        """ Scan the file and return the (points, size, lines) for an index.
+
+        """
+        pos = 0
+        while True:
+            pos = self._header(pos)
+            if pos is None:
+                break
+            pos = self._member(pos)
+        return self._points, self._offset, self._lines
+
+    def _header(self, pos):
+        """ Read a gzip member header and return the position of its data.
+
+        The return value is None at the end of the file.
+
+        """
+        stream = self._stream
+        stream.seek(pos)
+        header = stream.read(10)
+        if not header.strip("\x00"):
+            return None  # end of file or zero padding
+        if len(header) < 10 or header[:3] != "\x1f\x8b\x08":
+            raise IOError("not a gzip file")
+        flags = ord(header[3])
+        if flags & 4:  # FEXTRA
+            size = stream.read(2)
+            stream.read(ord(size[0]) + 256 * ord(size[1]))
+        for flag in (8, 16):  # FNAME, FCOMMENT
+            if flags & flag:
+                while stream.read(1) not in ("\x00", ""):
+                    continue
+        if flags & 2:  # FHCRC
+            stream.read(2)
+        return stream.tell()
+
+    def _member(self, pos):
+        """ Decompress a gzip member and return the position after its end.
+
+        """
+        if self._offset >= self._next:
+            # The beginning of the member's deflate data is a block boundary.
+            self._add(pos, 0)
+        decoder = decompressobj(-MAX_WBITS)
+        while not decoder.unused_data:
+            # Repeat until the end of the deflate data.
+            if self._offset >= self._next:
+                pos = self._search(decoder, pos)
+                continue
+            self._stream.seek(pos)
+            data = self._stream.read(self.chunk_size)
+            if not data:
+                raise IOError("truncated gzip file")
+            # Stop decompressing where the next point is due.
+            self._output(decoder.decompress(data, self._next - self._offset))
+            rest = decoder.unconsumed_tail or decoder.unused_data
+            pos += len(data) - len(rest)
+        return pos + 8  # skip the trailer
+
+    def _search(self, decoder, pos):
+        """ Feed input to a decoder one byte at a time to add a point.
+
+        This stops when a point is added, at the end of the deflate data, or
+        when the scan limit is reached. The return value is the position of
+        the next byte of input.
+
+        """
+        stream = self._stream
+        stream.seek(pos)
+        limit = pos + self.scan_limit
+        run = 0
+        while pos < limit:
+            byte = stream.read(1)
+            if not byte:
+                raise IOError("truncated gzip file")
+            text = decoder.decompress(byte)
+            if decoder.unused_data:
+                return pos  # end of deflate data
+            pos += 1
+            if text:
+                self._output(text)
+                run = 0
+                continue
+            run += 1
+            if run == self.run_size and self._boundary(decoder, pos - run):
+                return pos
+        self._next = self._offset + self._span  # give up on this point
+        return pos
+
+    def _boundary(self, decoder, pos):
+        """ Find a block boundary for a run of zero-output bytes at pos.
+
+        Returns True if a point was added.
+
+        """
+        stream = self._stream
+        window = self._window.value()
+        current = pos + self.run_size
+        stream.seek(current)
+        expected = decoder.copy().decompress(stream.read(self.chunk_size // 4))
+        for byte in xrange(max(pos - 1, 0), pos + 3):
+            stream.seek(byte)
+            data = stream.read(self.chunk_size // 4)
+            for bits in xrange(8):
+                resume = _Resume(_Point(byte, bits, 0, 0, window))
+                try:
+                    text = resume.decompress(data)
+                except ZlibError:
+                    continue
+                size = min(len(text), len(expected))
+                if size and text[:size] == expected[:size] and \
+                   (size >= 1024 or resume.unused_data):
+                    self._add(byte, bits, window)
+                    stream.seek(current)
+                    return True
+        stream.seek(current)
+        return False
+
+    def _add(self, pos, bits, window=None):
+        """ Add a point at the current uncompressed position.
+
+        """
+        if window is None:
+            window = self._window.value() if bits else ""
+        point = _Point(pos, bits, self._offset, self._lines, window)
+        self._points.append(point)
+        self._next = self._offset + self._span
+        return
+
+    def _output(self, text):
+        """ Account for decompressed output.
+
+        """
+        self._offset += len(text)
+        self._lines += text.count("\n")
+        self._window.append(text)
+        return
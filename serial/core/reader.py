@@ -5,11 +5,44 @@ Readers convert lines of text to data records.
 """
 from __future__ import absolute_import
 
+from array import array
+from collections import deque
+from cStringIO import StringIO
 from contextlib import contextmanager
+from heapq import heapify
+from heapq import heappop
+from heapq import heapreplace
+from io import open as io_open
+from itertools import islice
+from mmap import ACCESS_READ
+from mmap import mmap
+from multiprocessing import Pool
+from multiprocessing import cpu_count
+from operator import itemgetter
+from os import fstat
+from os import stat
+from stat import S_ISREG
+from threading import Thread
 
+from ._compile import decoder
 from ._util import Field
+from .dtype import ConstType
+from .dtype import FloatType
+from .dtype import IntType
+from .dtype import StringType
+from .stream import Bzip2IStream
+from .stream import GzippedIStream
+from .stream import XzIStream
 
-__all__ = ("DelimitedReader", "FixedWidthReader", "ReaderSequence")
+try:
+    import numpy
+except ImportError:  # NumPy is optional
+    numpy = None
+else:
+    _POWERS = 10.0 ** numpy.arange(16)
+
+__all__ = ("DelimitedReader", "FixedWidthReader", "MappedFixedWidthReader",
+           "MergeReader", "ParallelReader", "ReaderSequence")
 
 
 class _Reader(object):
@@ -28,6 +61,7 @@ class _Reader(object):
 
         """
         self._filters = []
+        self._stopped = False  # a filter stopped batch input
         return
 
     def filter(self, *callbacks):
@@ -77,6 +111,49 @@ class _Reader(object):
         """
         return self
 
+    def read_batch(self, count):
+        """ Return a list of up to count filtered records.
+
+        Filters are applied to an entire batch of records at a time, one filter
+        after another. If a filter signals the end of input the records it has
+        already passed are returned, and no further records will be read by
+        this method. An empty list is returned once input is exhausted.
+
+        """
+        batch = []
+        while len(batch) < count and not self._stopped:
+            # Repeat until the batch is full or input is exhausted.
+            records = self._get_batch(count - len(batch))
+            if not records:
+                break
+            for callback in self._filters:
+                # Apply each filter to all remaining records. A filter that
+                # stops input only affects the records after the current one.
+                passed = []
+                try:
+                    for record in records:
+                        record = callback(record)
+                        if record is not None:
+                            passed.append(record)
+                except StopIteration:
+                    self._stopped = True
+                records = passed
+            batch.extend(records)
+        return batch
+
+    def iter_batches(self, count):
+        """ Iterate over all filtered input records in batches.
+
+        Each batch is a list of up to count records (see read_batch()).
+
+        """
+        while True:
+            batch = self.read_batch(count)
+            if not batch:
+                break
+            yield batch
+        return
+
     def _get(self):
         """ Get the next parsed record from the input source.
 
@@ -87,6 +164,23 @@ class _Reader(object):
         """
         raise NotImplementedError
 
+    def _get_batch(self, count):
+        """ Get a list of up to count parsed records from the input source.
+
+        This is the batch equivalent of _get(); an empty list signals that
+        input has been exhausted. The default implementation calls _get()
+        for each record, but derived classes can override this with something
+        more efficient.
+
+        """
+        records = []
+        try:
+            for _ in xrange(count):
+                records.append(self._get())
+        except StopIteration:
+            pass
+        return records
+
 
 class _TabularReader(_Reader):
     """ Abstract base class for tabular data readers.
@@ -103,14 +197,15 @@ class _TabularReader(_Reader):
         
         The arguments are passed to the reader's constructor, except that the
         first argument is either an open stream or a file path that is used to 
-        open a text file for reading. In both cases the stream will be closed
-        upon exit from the context block.
+        open a text file for reading. A file compressed with gzip, bzip2, or
+        xz is decompressed automatically. In both cases the stream will be
+        closed upon exit from the context block.
         
         """
         # This assumes that first argument for all derived class constructors
         # is the stream; if not, this will need to be overridden.
         try:
-            stream = open(expr, "r")
+            stream = _open_path(expr)
         except TypeError:  # not a string
             stream = expr
         yield cls(stream, *args, **kwargs)
@@ -128,6 +223,7 @@ class _TabularReader(_Reader):
         self._stream = stream
         self._fields = [Field(*args) for args in fields]
         self._endl = endl
+        self._decode = self._compile()
         return
 
     def _get(self):
@@ -137,9 +233,117 @@ class _TabularReader(_Reader):
         StopIterator exception when the input stream is exhausted.
 
         """
-        tokens = self._split(self._stream.next().rstrip(self._endl))
-        return dict((field.name, field.dtype.decode(token)) for (field, token)
-                     in zip(self._fields, tokens))
+        return self._decode(self._stream.next().rstrip(self._endl))
+
+    def read_columns(self, count):
+        """ Return a batch of up to count filtered records as columns.
+
+        The batch is a dict of columns keyed by field name. IntType and
+        FloatType columns are NumPy arrays if NumPy is installed, otherwise
+        they are array.array objects. A numeric column is a list if it has any
+        missing values that decode to None. All other columns are lists. An
+        empty dict is returned once input has been exhausted.
+
+        Unfiltered input is decoded a column at a time. If the reader has any
+        filters the records are read with read_batch() instead and converted
+        to columns afterwards.
+
+        """
+        lines = None if self._filters else self._get_lines(count)
+        if lines is None:
+            records = self.read_batch(count)
+            if not records:
+                return {}
+            columns = []
+            for field in self._fields:
+                # Filters may add or remove fields.
+                name = field.name
+                values = [record.get(name) for record in records]
+                columns.append(_column(field.dtype, values))
+        else:
+            if not lines:
+                return {}
+            endl = self._endl
+            columns = self._decode_columns([line.rstrip(endl) for line in
+                                            lines])
+        return dict((field.name, column) for (field, column) in
+                    zip(self._fields, columns))
+
+    def iter_columns(self, count):
+        """ Iterate over all filtered input records in columnar batches.
+
+        Each batch is a dict of columns with up to count values each (see
+        read_columns()).
+
+        """
+        while True:
+            columns = self.read_columns(count)
+            if not columns:
+                break
+            yield columns
+        return
+
+    def _get_batch(self, count):
+        """ Return a list of up to count parsed records from the stream.
+
+        """
+        lines = self._get_lines(count)
+        if lines is None:
+            return super(_TabularReader, self)._get_batch(count)
+        decode = self._decode
+        endl = self._endl
+        return [decode(line.rstrip(endl)) for line in lines]
+
+    def _get_lines(self, count):
+        """ Return a list of up to count lines of text from the stream.
+
+        The return value is None if lines cannot be read in bulk, in which case
+        the caller must fall back to reading one record at a time.
+
+        """
+        if not hasattr(self._stream, "__iter__"):
+            return None
+        return list(islice(self._stream, count))
+
+    def _decode_columns(self, lines):
+        """ Decode lines of text into a column of values for each field.
+
+        """
+        columns = []
+        for field, tokens in zip(self._fields, self._columns(lines)):
+            values = _decode_column(field.dtype, tokens)
+            columns.append(_column(field.dtype, values))
+        return columns
+
+    def _columns(self, lines):
+        """ Split lines of text into columns of tokens.
+
+        The return value is a sequence containing a column of tokens for each
+        field. The default implementation uses _split() for each line, but
+        derived classes can override this with something more efficient.
+
+        """
+        return zip(*map(self._split, lines)) or [()] * len(self._fields)
+
+    def _compile(self):
+        """ Return a function that decodes a line of text into a record.
+
+        This is called once by the constructor. The default implementation
+        uses _split() to tokenize each line, but derived classes can override
+        this to return a function that is specialized for their field
+        definitions.
+
+        """
+        fields = self._fields
+        split = self._split
+
+        def decode(line):
+            """ Decode a line using the field definitions. """
+            tokens = split(line)
+            return dict((field.name, field.dtype.decode(token)) for
+                        (field, token) in zip(fields, tokens))
+
+        return decode
 
     def _split(self, line):
         """ Split a line of text into a sequence of tokens.
@@ -162,10 +366,31 @@ class DelimitedReader(_TabularReader):
         this time there is no way to escape delimiters.
 
         """
+        self._delim = delim  # needed by _compile()
         super(DelimitedReader, self).__init__(stream, fields)
-        self._delim = delim
         return
 
+    def _compile(self):
+        """ Return a function that decodes a line of text into a record.
+
+        """
+        if self._split.__func__ is not DelimitedReader._split.__func__:
+            # A derived class has its own _split() implementation.
+            return super(DelimitedReader, self)._compile()
+        prelude = "tokens = line.split(delim)"
+        return decoder(self._fields, "tokens", prelude, delim=self._delim)
+
+    def _columns(self, lines):
+        """ Split lines of text into columns of tokens.
+
+        """
+        if self._split.__func__ is not DelimitedReader._split.__func__:
+            # A derived class has its own _split() implementation.
+            return super(DelimitedReader, self)._columns(lines)
+        delim = self._delim
+        rows = [line.split(delim) for line in lines]
+        return [map(itemgetter(field.pos), rows) for field in self._fields]
+
     def _split(self, line):
         """ Split a line of text into a sequence of tokens.
 
@@ -183,6 +408,55 @@ class FixedWidthReader(_TabularReader):
     The character position of each field is given as the pair [beg, end).
 
     """
+    def _compile(self):
+        """ Return a function that decodes a line of text into a record.
+
+        """
+        if self._split.__func__ is not FixedWidthReader._split.__func__:
+            # A derived class has its own _split() implementation.
+            return super(FixedWidthReader, self)._compile()
+        return decoder(self._fields, "line")
+
+    def _columns(self, lines):
+        """ Split lines of text into columns of tokens.
+
+        """
+        if self._split.__func__ is not FixedWidthReader._split.__func__:
+            # A derived class has its own _split() implementation.
+            return super(FixedWidthReader, self)._columns(lines)
+        return [map(itemgetter(field.pos), lines) for field in self._fields]
+
+    def _decode_columns(self, lines):
+        """ Decode lines of text into a column of values for each field.
+
+        If NumPy is installed and all lines are the same length, the lines are
+        treated as a 2-D array of characters, and IntType and FloatType fields
+        are converted an entire column at a time. Otherwise, this falls back
+        to decoding each token.
+
+        """
+        if numpy is None or not isinstance(lines[0], str) or \
+           self._split.__func__ is not FixedWidthReader._split.__func__:
+            return super(FixedWidthReader, self)._decode_columns(lines)
+        width = len(lines[0])
+        if len(set(map(len, lines))) > 1:
+            # Lines are not all the same length.
+            return super(FixedWidthReader, self)._decode_columns(lines)
+        chars = numpy.frombuffer("".join(lines), numpy.uint8)
+        chars = chars.reshape(len(lines), width)
+        columns = []
+        for field in self._fields:
+            dtype = field.dtype
+            if type(dtype) in (IntType, FloatType):
+                pos = field.pos
+                if not isinstance(pos, slice):
+                    pos = slice(pos, pos + 1 or None)
+                columns.append(_vector_column(dtype, chars[:, pos]))
+            else:
+                tokens = map(itemgetter(field.pos), lines)
+                columns.append(_column(dtype, _decode_column(dtype, tokens)))
+        return columns
+
     def _split(self, line):
         """ Split a line of text into a sequence of tokens.
 
@@ -192,18 +466,181 @@ class FixedWidthReader(_TabularReader):
         return tuple(line[field.pos] for field in self._fields)
 
 
+class MappedFixedWidthReader(FixedWidthReader):
+    """ A random-access reader for fixed-width lines of text in a file.
+
+    The file is memory-mapped, and every line must be the same length,
+    including the line ending (the last line may be missing its line ending).
+    In addition to sequential iteration, records can be accessed by index
+    or slice, and each record is decoded directly from the mapped file when
+    it is accessed.
+
+    """
+    @classmethod
+    @contextmanager
+    def open(cls, expr, *args, **kwargs):
+        """ Create a runtime context for a MappedFixedWidthReader.
+
+        The arguments are passed to the reader's constructor, except that the
+        first argument is either an open file or a file path to open. The
+        reader and the file are closed upon exit from the context block.
+        Compressed files are not supported.
+
+        """
+        try:
+            stream = open(expr, "rb")
+        except TypeError:  # not a string
+            stream = expr
+        try:
+            reader = cls(stream, *args, **kwargs)
+            try:
+                yield reader
+            finally:
+                reader.close()
+        finally:
+            stream.close()
+        return
+
+    def __init__(self, stream, fields, endl="\n"):
+        """ Initialize this object.
+
+        The stream must be an open file object for an uncompressed regular
+        file, otherwise a ValueError is raised. The file can be closed once
+        the reader has been created. The length of the first line determines
+        the length of every line, and a ValueError is raised if the file size
+        is not consistent with this.
+
+        """
+        super(MappedFixedWidthReader, self).__init__(stream, fields, endl)
+        try:
+            stat = fstat(stream.fileno())
+        except (AttributeError, EnvironmentError, ValueError):
+            # No fileno(), or it isn't supported by the stream type.
+            raise ValueError("stream is not an open file")
+        if not S_ISREG(stat.st_mode):
+            raise ValueError("stream is not a regular file")
+        size = stat.st_size
+        self._map = None
+        self._stride = 0
+        self._count = 0
+        self._pos = 0  # index of the next record for sequential access
+        if not size:
+            return  # an empty file can't be mapped
+        self._map = mmap(stream.fileno(), 0, access=ACCESS_READ)
+        for prefix, adaptor in _CODECS:
+            if self._map[:len(prefix)] == prefix:
+                self.close()
+                raise ValueError("compressed files are not supported")
+        end = self._map.find(endl)
+        self._stride = size if end < 0 else end + len(endl)
+        if size % self._stride not in (0, self._stride - len(endl)):
+            raise ValueError("file contains lines of different lengths")
+        self._count = -(-size // self._stride)
+        return
+
+    def __len__(self):
+        """ Return the number of records in the file.
+
+        """
+        return self._count
+
+    def __getitem__(self, key):
+        """ Return the record at an index or a list of records for a slice.
+
+        Filters are not applied to records accessed this way.
+
+        """
+        if isinstance(key, slice):
+            return [self._record(pos) for pos in
+                    xrange(*key.indices(self._count))]
+        pos = key + self._count if key < 0 else key
+        if not 0 <= pos < self._count:
+            raise IndexError("record index out of range")
+        return self._record(pos)
+
+    def iter_range(self, start, stop=None):
+        """ Iterate over the filtered records with indexes in [start, stop).
+
+        The range is interpreted like a slice, e.g. negative indexes count
+        from the end of the file. This does not affect sequential access.
+
+        """
+        callbacks = self._filters
+        for pos in xrange(*slice(start, stop).indices(self._count)):
+            record = self._record(pos)
+            try:
+                for callback in callbacks:
+                    record = callback(record)
+                    if record is None:
+                        break
+            except StopIteration:
+                break
+            if record is not None:
+                yield record
+        return
+
+    def close(self):
+        """ Release the memory map.
+
+        The reader cannot be used after it has been closed.
+
+        """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._count = 0
+        return
+
+    def _get(self):
+        """ Return the next parsed record from the file.
+
+        """
+        if self._pos >= self._count:
+            raise StopIteration
+        self._pos += 1
+        return self._record(self._pos - 1)
+
+    def _get_lines(self, count):
+        """ Return a list of up to count lines of text from the file.
+
+        """
+        beg = self._pos
+        end = min(beg + count, self._count)
+        if end <= beg:
+            return []  # also avoids a zero stride for an empty file
+        self._pos = end
+        stride = self._stride
+        return [self._map[pos:pos+stride] for pos in
+                xrange(beg * stride, end * stride, stride)]
+
+    def _record(self, pos):
+        """ Decode the record at the given index.
+
+        """
+        beg = pos * self._stride
+        line = self._map[beg:beg+self._stride]
+        return self._decode(line.rstrip(self._endl))
+
+
 class ReaderSequence(_Reader):
     """ Iterate over a sequence of files/streams as a single sequence.
     
     """
-    def __init__(self, reader, *args):
+    def __init__(self, reader, *args, **kwargs):
         """ Initialize this object.
         
         The reader argument is a callable object that takes a stream as its
         only argument and returns a Reader to use on each input stream, e.g. 
         a Reader constructor. The remaining arguments are either open streams
-        or paths to open as plain text files. Each input stream is closed once
-        it has been exhuasted.
+        or paths to open as text files; compressed files are decompressed
+        automatically (see _TabularReader.open()). Each input stream is closed
+        once it has been exhuasted.
+
+        The optional prefetch keyword argument is the number of upcoming paths
+        to open in background threads while the current stream is being read.
+        The first block of data from each of these files is read in advance,
+        which hides the latency of opening files on slow or remote storage.
+        Streams that are already open are used as is.
         
         Filtering is applied at the ReaderSequence level, but for filters that
         raise StopIteration this might not be the desired behavior. Halting
@@ -213,9 +650,14 @@ class ReaderSequence(_Reader):
         applied.
         
         """
+        prefetch = kwargs.pop("prefetch", 0)
+        if kwargs:
+            message = "unexpected keyword argument: {0:s}"
+            raise TypeError(message.format(kwargs.keys()[0]))
         super(ReaderSequence, self).__init__()
         self._input = list(args)
         self._reader = reader
+        self._prefetch = prefetch
         self._active = None
         self._open()
         return
@@ -231,23 +673,47 @@ class ReaderSequence(_Reader):
             except StopIteration:
                 # The current stream is exhausted, try the next one. 
                 self._open()
+
+    def _get_batch(self, count):
+        """ Return a list of up to count parsed records from the sequence.
+
+        """
+        # Records are only taken from one stream at a time, so the batch may
+        # be short at the end of each stream.
+        while self._active is not None:
+            # Repeat until records are returned or the sequence is exhausted.
+            records = self._active.read_batch(count)
+            if records:
+                return records
+            try:
+                self._open()
+            except StopIteration:
+                break
+        return []
         
     def _open(self):
         """ Open the next stream in the sequence.
         
         """
-        if self._active:
+        if self._active is not None:
             # Close the open stream.
             self._input.pop(0).close()
         try:
             # Try to open a path as a text file.
-            self._input[0] = open(self._input[0], "r")
+            self._input[0] = _open_path(self._input[0])
         except TypeError:
             # Not a string, assume it's an open stream.
             pass
         except IndexError:
             # No more streams.
+            self._active = None
             raise StopIteration
+        if isinstance(self._input[0], _PrefetchStream):
+            self._input[0] = self._input[0].wait()
+        for pos, expr in enumerate(self._input[1:self._prefetch+1], 1):
+            # Start reading ahead for upcoming paths.
+            if isinstance(expr, basestring):
+                self._input[pos] = _PrefetchStream(expr)
         self._active = self._reader(self._input[0])
         return 
         
@@ -271,6 +737,533 @@ class ReaderSequence(_Reader):
         return
 
 
+class MergeReader(_Reader):
+    """ Merge multiple sorted sources into a single sorted sequence.
+
+    Each source must already be sorted by the same key. Records are merged
+    using a heap, so each record costs O(log N) for N sources, and only one
+    record per source is held in memory.
+
+    """
+    def __init__(self, key, *args, **kwargs):
+        """ Initialize this object.
+
+        The key is a field name, a sequence of field names, or a callable
+        object that takes a record as its only argument and returns its sort
+        key. The remaining arguments are the sources to merge. By default they
+        are Readers (or any iterators over records). If the optional reader
+        keyword argument is given, the sources are either open streams or
+        paths to open as for a ReaderSequence, and reader is a callable object
+        that takes a stream as its only argument and returns a Reader for it.
+        Streams are closed once they have been exhausted.
+
+        Records with equal keys are returned in the order of their sources, so
+        the merge is stable.
+
+        """
+        reader = kwargs.pop("reader", None)
+        if kwargs:
+            message = "unexpected keyword argument: {0:s}"
+            raise TypeError(message.format(kwargs.keys()[0]))
+        super(MergeReader, self).__init__()
+        if not callable(key):
+            if isinstance(key, basestring):
+                key = (key,)
+            key = itemgetter(*key)
+        self._key = key
+        self._streams = []
+        self._heap = []
+        for pos, source in enumerate(args):
+            if reader is not None:
+                try:
+                    source = _open_path(source)
+                except TypeError:  # not a string, assume it's a stream
+                    pass
+                self._streams.append(source)
+                source = reader(source)
+            self._push(pos, source)
+        heapify(self._heap)
+        return
+
+    def _get(self):
+        """ Return the next parsed record from the merged sources.
+
+        """
+        try:
+            item = self._heap[0]
+        except IndexError:  # all sources are exhausted
+            raise StopIteration
+        pos, source = item[1], item[3]
+        try:
+            record = source.next()
+        except StopIteration:
+            heappop(self._heap)
+            self._close(pos)
+        else:
+            heapreplace(self._heap, (self._key(record), pos, record, source))
+        return item[2]
+
+    def _push(self, pos, source):
+        """ Add the first record from a source to the heap.
+
+        """
+        try:
+            record = source.next()
+        except StopIteration:
+            self._close(pos)
+        else:
+            self._heap.append((self._key(record), pos, record, source))
+        return
+
+    def _close(self, pos):
+        """ Close the stream for an exhausted source.
+
+        """
+        if self._streams:
+            self._streams[pos].close()
+        return
+
+    def __enter__(self):
+        """ Enter a context block.
+
+        """
+        return self
+
+    def __exit__(self, etype=None, value=None, trace=None):
+        """ Exit a context block.
+
+        """
+        # The exception-handling arguments are ignored; if the context exits
+        # due to an exception it will be passed along to the caller.
+        for stream in self._streams:
+            try:
+                stream.close()
+            except AttributeError:  # no close
+                continue
+        return
+
+
+class ParallelReader(_Reader):
+    """ Read a single file using multiple processes.
+
+    The file is divided into chunks that are decoded in parallel by a pool of
+    worker processes, and records are returned in their original order.
+
+    """
+    def __init__(self, reader, path, processes=None, chunksize=4194304):
+        """ Initialize this object.
+
+        The reader argument is a callable object that takes a stream as its
+        only argument and returns a Reader to use on each chunk of the file,
+        e.g. a Reader constructor. It is called in the worker processes, so
+        it may need to be picklable on platforms that don't support fork().
+        The path is the file to read. The file is divided into chunks of about
+        chunksize bytes; each chunk ends with a complete line. The number of
+        worker processes defaults to the number of CPUs. At most two chunks
+        per process are decoded ahead of the records being read, so memory
+        use does not depend on the size of the file.
+
+        Filters added to this reader are applied in the calling process. Any
+        filters applied by the reader callable are applied to each chunk in
+        the worker processes, so a filter that raises StopIteration there only
+        stops its own chunk.
+
+        """
+        super(ParallelReader, self).__init__()
+        self._tasks = deque((path, beg, end) for (beg, end) in
+                            _chunks(path, chunksize))
+        self._pool = Pool(processes, _init_worker, (reader,))
+        self._window = 2 * (processes or cpu_count())
+        self._results = deque()  # pending chunks in order
+        self._records = []
+        self._pos = 0
+        self._submit()
+        return
+
+    def close(self):
+        """ Stop the worker processes.
+
+        This is called automatically once input has been exhausted or when
+        exiting a context block.
+
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            self._tasks.clear()
+            self._results.clear()
+        return
+
+    def _get(self):
+        """ Return the next parsed record from the file.
+
+        """
+        records = self._get_batch(1)
+        if not records:
+            raise StopIteration
+        return records[0]
+
+    def _get_batch(self, count):
+        """ Return a list of up to count parsed records from the file.
+
+        """
+        # Records are only taken from one chunk at a time, so the batch may be
+        # short at the end of each chunk.
+        while self._pos >= len(self._records):
+            # Repeat until a chunk has records or input is exhausted.
+            if not self._results:
+                self.close()
+                return []
+            self._records = self._results.popleft().get()
+            self._pos = 0
+            self._submit()
+        beg = self._pos
+        self._pos += count
+        return self._records[beg:self._pos]
+
+    def _submit(self):
+        """ Submit chunks to the worker processes until the window is full.
+
+        """
+        while self._tasks and len(self._results) < self._window:
+            task = self._tasks.popleft()
+            self._results.append(self._pool.apply_async(_read_chunk, (task,)))
+        return
+
+    def __enter__(self):
+        """ Enter a context block.
+
+        """
+        return self
+
+    def __exit__(self, etype=None, value=None, trace=None):
+        """ Exit a context block.
+
+        """
+        # The exception-handling arguments are ignored; if the context exits
+        # due to an exception it will be passed along to the caller.
+        self.close()
+        return
+
+
+def _chunks(path, chunksize):
+    """ Return the [beg, end) byte offsets of each chunk of a file.
+
+    Each chunk is at least chunksize bytes long (except for the last one) and
+    ends after a complete line, so a line belongs to the chunk it starts in.
+
+    """
+    chunks = []
+    with open(path, "rb") as stream:
+        size = fstat(stream.fileno()).st_size
+        beg = 0
+        while beg < size:
+            stream.seek(min(beg + max(chunksize, 1), size) - 1)
+            stream.readline()  # finish the current line
+            end = stream.tell()
+            chunks.append((beg, end))
+            beg = end
+    return chunks
+
+
+# The reader callable for a ParallelReader worker process.
+
+_worker_reader = None
+
+
+def _init_worker(reader):
+    """ Initialize a ParallelReader worker process.
+
+    """
+    global _worker_reader
+    _worker_reader = reader
+    return
+
+
+def _read_chunk(task):
+    """ Decode a chunk of a file in a ParallelReader worker process.
+
+    """
+    path, beg, end = task
+    with open(path, "rb") as stream:
+        stream.seek(beg)
+        data = stream.read(end - beg)
+    # Every line is at least one byte long, so this reads the entire chunk.
+    return _worker_reader(StringIO(data)).read_batch(end - beg)
+
+
+class _PrefetchStream(object):
+    """ A text file that is opened and read ahead in a background thread.
+
+    """
+    block_size = 65536  # bytes to read ahead
+
+    def __init__(self, path):
+        """ Initialize this object.
+
+        """
+        self._stream = None
+        self._codec = None
+        self._buffer = None
+        self._error = None
+        self._thread = Thread(target=self._fetch, args=(path,))
+        self._thread.daemon = True
+        self._thread.start()
+        return
+
+    def next(self):
+        """ Return the next line of text.
+
+        """
+        if self._buffer is None:
+            return self._stream.next()
+        line = self._buffer.readline()
+        if line.endswith("\n"):
+            return line
+        # The buffered data is exhausted, so finish the current line from the
+        # file and read directly from it from now on. The file is a builtin
+        # file for a regular path or an io.BufferedReader for a pipe (see
+        # _open_path()). For a builtin file, iteration has its own read-ahead
+        # buffer, so a caller can't mix next() and read() after this point.
+        self._buffer = None
+        line += self._stream.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def __iter__(self):
+        """ Iterate over each line of text.
+
+        """
+        # Once the buffered data is exhausted the file's own iterator is used.
+        return self if self._buffer is not None else iter(self._stream)
+
+    def read(self, size=-1):
+        """ Read up to size bytes, or all remaining data if size is negative.
+
+        """
+        if self._buffer is None:
+            return self._stream.read(size)
+        data = self._buffer.read(size)
+        if len(data) == size:
+            return data
+        self._buffer = None
+        size = size - len(data) if size >= 0 else -1
+        return data + self._stream.read(size)
+
+    def close(self):
+        """ Close the file.
+
+        """
+        self._thread.join()
+        if self._stream is not None:
+            self._stream.close()
+        return
+
+    def _fetch(self, path):
+        """ Open the file and read the first block of data.
+
+        This is executed in the background thread.
+
+        """
+        try:
+            self._stream, self._codec = _open_path(path, False)
+            self._buffer = StringIO(self._stream.read(self.block_size))
+        except EnvironmentError as err:
+            # Report the error when the file is used.
+            self._error = err
+        return
+
+    def wait(self):
+        """ Wait for the background thread to finish and return the stream.
+
+        This must be called before the stream is used. The return value is
+        this object or a decompression adaptor for it. Any error that occurred
+        while opening or reading the file is raised here.
+
+        """
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self if self._codec is None else self._codec(self)
+
+
+def _open_path(path, wrap=True):
+    """ Open a text file for reading.
+
+    If the file is compressed its format is detected from the first few bytes
+    of the file. If wrap is True the return value is the file with the
+    matching decompression adaptor applied, otherwise it's a (stream, adaptor)
+    pair, where adaptor is None for an uncompressed file.
+
+    """
+    try:
+        regular = S_ISREG(stat(path).st_mode)
+    except OSError:  # let open() report the error
+        regular = True
+    if regular:
+        stream = open(path, "rb")
+        adaptor = _codec(stream.read(_MAGIC_SIZE))
+        if adaptor is None:
+            # Reopen in text mode.
+            stream.close()
+            stream = open(path, "r")
+        else:
+            stream.seek(0)
+    else:
+        # An unseekable file like a named pipe can only be read once, so the
+        # header is examined through a buffered stream without consuming it.
+        # For a pipe peek() may return fewer bytes than a complete header if
+        # the writer hasn't written them yet, in which case the input is read
+        # as text.
+        stream = io_open(path, "rb")
+        adaptor = _codec(stream.peek(_MAGIC_SIZE))
+    if not wrap:
+        return stream, adaptor
+    return stream if adaptor is None else adaptor(stream)
+
+
+# A bzip2 header is "BZh", the block size, and the magic number of the first
+# block or of the end of the stream for an empty file.
+
+_CODECS = (
+    ("\x1f\x8b", GzippedIStream),
+    ("\xfd7zXZ\x00", XzIStream)) + tuple(
+    ("BZh" + level + magic, Bzip2IStream) for level in "123456789" for magic
+    in ("1AY&SY", "\x17rE8P\x90"))
+
+_MAGIC_SIZE = max(len(prefix) for prefix, adaptor in _CODECS)
+
+
+def _codec(magic):
+    """ Return the decompression adaptor for a file header, or None.
+
+    """
+    for prefix, adaptor in _CODECS:
+        if magic.startswith(prefix):
+            return adaptor
+    return None
+
+
+def _decode_column(dtype, tokens):
+    """ Decode a column of tokens into a list of values.
+
+    """
+    # Exact type checks are used so that derived classes that override
+    # decode() are handled correctly.
+    kind = type(dtype)
+    if kind is ConstType:
+        return [dtype.decode(None)] * len(tokens)
+    if kind in (IntType, FloatType):
+        try:
+            # Try converting the entire column at once; the int() and float()
+            # constructors ignore leading and trailing whitespace.
+            return map(dtype._dtype, tokens)
+        except ValueError:
+            # There are blank or invalid tokens, so fall through and replace
+            # them with the default value.
+            pass
+    elif kind is StringType:
+        default = dtype._default
+        if dtype._quote:
+            quote = dtype._quote
+            return [token.strip().strip(quote) or default for token in tokens]
+        return [token.strip() or default for token in tokens]
+    return map(dtype.decode, tokens)
+
+
+def _column(dtype, values):
+    """ Return a column of values as a typed array if possible.
+
+    """
+    try:
+        typecode = _TYPECODES[type(dtype)]
+    except KeyError:  # not a numeric type
+        return values
+    if None in values:
+        # Arrays can't have missing values.
+        return values
+    try:
+        if numpy is not None:
+            return numpy.array(values, dtype=typecode)
+        return array(typecode, values)
+    except (OverflowError, TypeError, ValueError):  # incompatible values
+        return values
+
+
+_TYPECODES = {IntType: "l", FloatType: "d"}
+
+
+def _vector_column(dtype, chars):
+    """ Decode a column of IntType or FloatType tokens with NumPy.
+
+    The chars argument is a 2-D array of characters with one row per token.
+    Tokens that aren't simple decimal numbers are decoded individually.
+
+    """
+    values, valid = _parse_numeric(chars, type(dtype) is FloatType)
+    if valid.all():
+        return values.astype(_TYPECODES[type(dtype)])
+    values = values.tolist()
+    for pos in numpy.flatnonzero(~valid).tolist():
+        values[pos] = dtype.decode(chars[pos].tostring())
+    return _column(dtype, values)
+
+
+def _parse_numeric(chars, decimal):
+    """ Parse a column of fixed-width numeric tokens with NumPy.
+
+    The chars argument is a 2-D uint8 array with one row per token. A token is
+    valid if it is a decimal number with an optional minus sign and optional
+    leading and trailing spaces, and it has few enough digits to be converted
+    exactly. If decimal is True tokens can have a decimal point and float
+    values are returned, otherwise int values are returned. The return value
+    is a (values, valid) pair of arrays.
+
+    """
+    # All operations are done on an entire column of tokens at a time. The
+    # array is transposed so each character position is a contiguous row.
+    count, width = chars.shape
+    chars = numpy.ascontiguousarray(chars.T)
+    digits = chars - numpy.uint8(48)  # non-digits wrap around to > 9
+    isdigit = digits < 10
+    isspace = chars == 32
+    isminus = chars == 45
+    allowed = isdigit | isspace | isminus
+    if decimal:
+        isdot = chars == 46
+        allowed |= isdot
+    valid = allowed.all(axis=0)
+    valid &= isdigit.any(axis=0)
+    if width > (15 if decimal else 18):
+        # Limit the number of digits so the mantissa is exact.
+        valid &= isdigit.sum(axis=0) <= (15 if decimal else 18)
+    if width == 0:
+        return numpy.zeros(count, float if decimal else int), valid
+    # Nonspace characters must be contiguous, and a minus sign must be the
+    # first of them.
+    body = ~isspace
+    valid &= (body[0] + (body[1:] & isspace[:-1]).sum(axis=0)) == 1
+    valid &= ~(isminus[1:] & body[:-1]).any(axis=0)
+    mantissa = numpy.zeros(count, numpy.int64)
+    scale = 1 + 9 * isdigit.view(numpy.uint8)  # 10 for digits, 1 otherwise
+    digits *= isdigit
+    for pos in range(width):
+        mantissa *= scale[pos]
+        mantissa += digits[pos]
+    negative = isminus.any(axis=0)
+    mantissa[negative] *= -1
+    if not decimal:
+        return mantissa, valid
+    valid &= isdot.sum(axis=0) <= 1
+    point = numpy.where(isdot.any(axis=0), isdot.argmax(axis=0), width)
+    end = width - body[::-1].argmax(axis=0)
+    values = mantissa / _POWERS[numpy.clip(end - point - 1, 0, 15)]
+    values[negative & (mantissa == 0)] = -0.0
+    return values, valid
+
+
 # class ContextualReader(_Reader):
 #     """ A reader for contextual lines.
 #
@@ -3,11 +3,29 @@
 """
 from __future__ import absolute_import
 
+from bz2 import BZ2Decompressor
+from collections import deque
+from cStringIO import StringIO
+from multiprocessing import cpu_count
+from multiprocessing.dummy import Pool
+from zlib import compressobj
 from zlib import decompressobj
+from zlib import DEFLATED
 from zlib import MAX_WBITS
 
-__all__ = ("BufferedIStream", "FilteredIStream", "FilteredOStream",
-           "GzippedIStream")
+from .index import _Resume
+
+try:
+    from lzma import LZMADecompressor
+except ImportError:
+    try:
+        from backports.lzma import LZMADecompressor
+    except ImportError:  # xz support is optional
+        LZMADecompressor = None
+
+__all__ = ("BufferedIStream", "Bzip2IStream", "FilteredIStream",
+           "FilteredOStream", "GzippedIStream", "GzippedOStream",
+           "ParallelGzippedOStream", "XzIStream")
 
 
 class _StreamAdaptor(object):
@@ -74,7 +92,10 @@ class BufferedIStream(_IStreamAdaptor):
     """ Add buffering to an input stream.
 
     The buffered stream can be rewound to lines previously retrieved via the
-    next() method.
+    next() method. Normally the most recent bufsize lines are retained, but
+    after a call to mark() every line is retained until reset() is called, so
+    a client can look ahead an arbitrary number of lines and then return to
+    the marked position.
 
     """
     def __init__(self, stream, bufsize=1):
@@ -82,42 +103,76 @@ class BufferedIStream(_IStreamAdaptor):
 
         """
         super(BufferedIStream, self).__init__(stream)
-        self._buffer = []  # newest record at end
-        while len(self._buffer) < bufsize:
+        self._bufsize = bufsize
+        self._buffer = deque()  # lines already returned, newest at end
+        self._pending = deque()  # rewound lines, next line at front
+        while len(self._pending) < bufsize:
             # Fill the buffer one record at a time.
             try:
-                self._buffer.append(self._stream.next())
+                self._pending.append(self._stream.next())
             except StopIteration:  # stream is exhausted
                 # Don't raise StopIteration until self.next() is called with an
                 # exhausted buffer.
                 break
-        self._bufpos = 0  # always points to the current record
+        self._pos = 0  # number of lines returned net of rewinds
+        self._mark = None
         return
 
     def next(self):
         """ Return the next line of text.
 
-        If the stream has been rewound this will return the first buffered 
+        If the stream has been rewound this will return the first buffered
         line, otherwise the next line from the input stream.
 
         """
         try:
-            line = self._buffer[self._bufpos]
-            self._bufpos += 1
+            line = self._pending.popleft()
         except IndexError:
             # At the end of the buffer so get a new line.
-            line = self._stream.next() 
-            del self._buffer[0]
-            self._buffer.append(line)
+            line = self._stream.next()
+        self._buffer.append(line)
+        if self._mark is None and len(self._buffer) > self._bufsize:
+            self._buffer.popleft()
+        self._pos += 1
         return line
 
     def rewind(self, count=None):
         """ Rewind the buffer.
-        
+
         By default rewind to the beginning of the buffer.
 
         """
-        self._bufpos = 0 if count is None else max(0, self._bufpos - count)
+        if count is None or count > len(self._buffer):
+            count = len(self._buffer)
+        for _ in range(count):
+            self._pending.appendleft(self._buffer.pop())
+        self._pos -= count
+        return
+
+    def mark(self):
+        """ Mark the current position in the stream.
+
+        All lines read after the mark are retained regardless of the buffer
+        size, so reset() can always return to this position. Marking the
+        stream again moves the mark.
+
+        """
+        self._mark = self._pos
+        return
+
+    def reset(self):
+        """ Rewind the stream to the marked position and clear the mark.
+
+        A ValueError is raised if the stream has not been marked.
+
+        """
+        if self._mark is None:
+            raise ValueError("stream has not been marked")
+        self.rewind(max(0, self._pos - self._mark))
+        self._mark = None
+        while len(self._buffer) > self._bufsize:
+            # Discard the lines that were only retained for the mark.
+            self._buffer.popleft()
         return
 
 
@@ -162,60 +217,240 @@ class FilteredIStream(_IStreamAdaptor):
         return line
 
 
-class GzippedIStream(_IStreamAdaptor):
-    """ Add gzip/zlib decompression to a text input stream.
-    
-    Unlike the Python gzip module, this will work with streaming data, e.g. a
-    urlopen() stream.
-    
+class _DecompressedIStream(_IStreamAdaptor):
+    """ Abstract base class for adding decompression to a text input stream.
+
+    This will work with streaming data, e.g. a urlopen() stream. Concatenated
+    compressed streams are read as a single stream.
+
     """
-    read_size = 1024  # bytes; adjust to maximize performance
-      
+    read_size = 4096  # initial read size in bytes
+    max_read_size = 1048576  # bytes; adjust to maximize performance
+
     def __init__(self, stream):
         """ Initialize this object.
-        
+
         The input stream must implement a read() method that returns a user-
         specified number of bytes, e.g. any file-like object.
-        
+
         """
-        super(GzippedIStream, self).__init__(stream)
-        self._decode = decompressobj(MAX_WBITS + 32).decompress
-        self._buffer = ""
+        super(_DecompressedIStream, self).__init__(stream)
+        self._blocks = self._decompress()
+        self._lines = []  # lines from the current decompressed block
+        self._pos = 0  # position of the next line in self._lines
+        self._size = 0  # size of the text in self._lines
+        self._tail = []  # pieces of an incomplete line
         return
-            
+
     def next(self):
         """ Return the next line of text.
         
         """
-        def read():
-            """ Retrieve decompressed data from the stream. """
-            # The block size is based on the compressed data; the returned data
-            # size may be different. 
-            data = self._stream.read(self.read_size)
-            if not data:
-                # Check for EOF before decoding because the decoded value will
-                # be an empty string if data does not contain a complete
-                # encoded sequence.
-                return False
-            self._buffer += self._decode(data)
-            return True
-        
+        while self._pos >= len(self._lines):
+            # Repeat until a line is available or input is exhausted.
+            if not self._fill():
+                raise StopIteration
+        line = self._lines[self._pos]
+        self._pos += 1
+        return line
+
+    def readlines(self, sizehint=0):
+        """ Return a list of lines of text.
+
+        If sizehint is positive, lines are returned one decompressed block at
+        a time until they total at least sizehint bytes. Otherwise, all
+        remaining lines are returned. An empty list is returned once input has
+        been exhausted.
+
+        """
+        lines = []
+        size = 0
+        while self._pos < len(self._lines) or self._fill():
+            # Take all buffered lines at once.
+            lines.extend(self._lines[self._pos:] if self._pos else self._lines)
+            size += self._size
+            self._lines = []
+            self._pos = 0
+            if 0 < sizehint <= size:
+                break
+        return lines
+
+    def _fill(self):
+        """ Split the next block of decompressed data into lines.
+
+        Returns False if input has been exhausted.
+
+        """
+        tail = self._tail
+        for block in self._blocks:
+            tail.append(block)
+            if "\n" not in block:
+                # Keep accumulating a line that is longer than a block.
+                continue
+            text = "".join(tail)
+            lines = StringIO(text).readlines()
+            del tail[:]
+            if not lines[-1].endswith("\n"):
+                # Save an incomplete last line for the next block.
+                tail.append(lines.pop())
+            break
+        else:
+            # This is the last line (the newline is missing).
+            text = "".join(tail)
+            lines = [text] if text else []
+            del tail[:]
+        self._lines = lines
+        self._pos = 0
+        self._size = len(text) if lines else 0
+        return bool(lines)
+
+    def _decompress(self):
+        """ Generate blocks of decompressed data.
+
+        """
+        # The read size starts small so that the first lines are available
+        # quickly from a slow stream, and it grows for better throughput. The
+        # block size is based on the compressed data; the decompressed size
+        # will be different.
+        size = self.read_size
+        decoder = self._decoder()
         while True:
-            # Find the end of the next complete line.
-            try:
-                pos = self._buffer.index("\n") + 1  # include \n
-            except ValueError:  # \n not found
-                # Keep going as long as the stream is still good, otherwise
-                # this is the last line (the newline is missing).
-                if read():
+            data = self._stream.read(size)
+            if not data:
+                break
+            size = min(size * 2, self.max_read_size)
+            while data:
+                try:
+                    block = decoder.decompress(data)
+                except EOFError:
+                    # The previous stream ended at the end of the last read,
+                    # and this decoder doesn't accept any more data.
+                    decoder = self._decoder()
                     continue
-                pos = len(self._buffer) 
-            break
-        if not self._buffer:
-            raise StopIteration
-        line = self._buffer[:pos]
-        self._buffer = self._buffer[pos:]
-        return line
+                if block:
+                    yield block
+                data = decoder.unused_data
+                if data:
+                    # This is the beginning of another compressed stream.
+                    decoder = self._decoder()
+        try:
+            block = decoder.flush()
+        except AttributeError:  # no flush()
+            block = None
+        if block:
+            yield block
+        return
+
+    def _decoder(self):
+        """ Return a new decompressor object.
+
+        The object must have a decompress() method and an unused_data
+        attribute for any data following the end of the compressed stream.
+
+        """
+        raise NotImplementedError
+
+
+class GzippedIStream(_DecompressedIStream):
+    """ Add gzip/zlib decompression to a text input stream.
+
+    Unlike the Python gzip module, this will work with streaming data, e.g. a
+    urlopen() stream. Concatenated gzip members are read as a single stream.
+
+    """
+    def __init__(self, stream, index=None, line=None, offset=None):
+        """ Initialize this object.
+
+        If a GzipIndex for the stream is given, input can start at a line
+        number or a byte offset in the uncompressed data, counting from 0. The
+        stream must be seekable in this case. Starting at a byte offset can
+        result in a partial first line.
+
+        """
+        super(GzippedIStream, self).__init__(stream)
+        self._resume = None
+        if index is None:
+            return
+        offset = offset or 0
+        point = index.locate(offset, line)
+        if point is None:
+            # Start at the beginning of the stream.
+            stream.seek(0)
+            self._skip(line, offset)
+        else:
+            stream.seek(point.compressed)
+            self._resume = _Resume(point)
+            if line is None:
+                self._skip(None, offset - point.offset)
+            else:
+                self._skip(line - point.line, None)
+        return
+
+    def _skip(self, lines, size):
+        """ Skip a number of lines or a number of bytes of text.
+
+        """
+        while lines or size:
+            # Repeat until the requested lines or bytes have been skipped.
+            if self._pos >= len(self._lines) and not self._fill():
+                break
+            if lines:
+                count = min(lines, len(self._lines) - self._pos)
+                self._pos += count
+                lines -= count
+                continue
+            line = self._lines[self._pos]
+            if len(line) > size:
+                self._lines[self._pos] = line[size:]
+                break
+            self._pos += 1
+            size -= len(line)
+        return
+
+    def _decoder(self):
+        """ Return a new decompressor object.
+
+        """
+        resume, self._resume = self._resume, None
+        if resume is not None:
+            return resume
+        return decompressobj(MAX_WBITS + 32)  # detect gzip or zlib header
+
+
+class Bzip2IStream(_DecompressedIStream):
+    """ Add bzip2 decompression to a text input stream.
+
+    Concatenated bzip2 streams, e.g. from pbzip2, are read as a single stream.
+
+    """
+    def _decoder(self):
+        """ Return a new decompressor object.
+
+        """
+        return BZ2Decompressor()
+
+
+class XzIStream(_DecompressedIStream):
+    """ Add xz decompression to a text input stream.
+
+    This requires the lzma module (Python 3.3+) or the backports.lzma package.
+    Concatenated xz streams are read as a single stream.
+
+    """
+    def __init__(self, stream):
+        """ Initialize this object.
+
+        """
+        if LZMADecompressor is None:
+            raise NotImplementedError("xz decompression is not available")
+        super(XzIStream, self).__init__(stream)
+        return
+
+    def _decoder(self):
+        """ Return a new decompressor object.
+
+        """
+        return LZMADecompressor()
 
 
 class _OStreamAdaptor(_StreamAdaptor):
@@ -231,6 +466,16 @@ class _OStreamAdaptor(_StreamAdaptor):
         """
         raise NotImplementedError
 
+    def writelines(self, lines):
+        """ Write a sequence of lines to the stream.
+
+        The default implementation calls write() for each line.
+
+        """
+        for line in lines:
+            self.write(line)
+        return
+
 
 class FilteredOStream(_OStreamAdaptor):
     """ Apply filters to an output stream.
@@ -263,3 +508,164 @@ class FilteredOStream(_OStreamAdaptor):
                 return
         self._stream.write(line)
         return
+
+
+class GzippedOStream(_OStreamAdaptor):
+    """ Add gzip compression to a text output stream.
+
+    Lines are accumulated into large blocks of text before being compressed.
+    The adaptor must be closed to write the end of the gzip data.
+
+    """
+    block_size = 1048576  # bytes; adjust to maximize performance
+
+    def __init__(self, stream, level=6):
+        """ Initialize this object.
+
+        The output stream must implement a write() method that accepts binary
+        data, e.g. a file opened in binary mode. The compression level is an
+        integer from 1 (fastest) to 9 (smallest).
+
+        """
+        super(GzippedOStream, self).__init__(stream)
+        self._encoder = compressobj(level, DEFLATED, MAX_WBITS + 16)
+        self._block = []
+        self._size = 0  # size of the text in self._block
+        return
+
+    def write(self, line):
+        """ Write a line of text to the stream.
+
+        """
+        self._block.append(line)
+        self._size += len(line)
+        if self._size >= self.block_size:
+            self._flush()
+        return
+
+    def writelines(self, lines):
+        """ Write a sequence of lines to the stream.
+
+        """
+        block = self._block
+        limit = self.block_size
+        for line in lines:
+            block.append(line)
+            self._size += len(line)
+            if self._size >= limit:
+                self._flush()
+        return
+
+    def close(self):
+        """ Finish the compressed data and close the stream.
+
+        """
+        if self._encoder is not None:
+            self._flush()
+            self._stream.write(self._finish())
+            self._encoder = None
+        super(GzippedOStream, self).close()
+        return
+
+    def _flush(self):
+        """ Compress the current block of text and write it to the stream.
+
+        """
+        data = self._compress("".join(self._block))
+        del self._block[:]
+        self._size = 0
+        if data:
+            self._stream.write(data)
+        return
+
+    def _compress(self, text):
+        """ Return compressed data for a block of text.
+
+        The compressor may buffer data internally, so the return value can be
+        an empty string.
+
+        """
+        return self._encoder.compress(text)
+
+    def _finish(self):
+        """ Return the remaining compressed data and the gzip trailer.
+
+        """
+        return self._encoder.flush()
+
+
+class ParallelGzippedOStream(GzippedOStream):
+    """ Add multi-threaded gzip compression to a text output stream.
+
+    Each block of text is compressed by a pool of threads as an independent
+    gzip member, and the members are written in order. Any gzip reader that
+    supports concatenated members can read the output, including gzip and
+    GzippedIStream. Because blocks are compressed independently the output is
+    slightly larger than the output of GzippedOStream.
+
+    """
+    def __init__(self, stream, level=6, threads=None):
+        """ Initialize this object.
+
+        The number of compression threads defaults to the number of CPUs.
+        Compressed blocks are written as soon as they are complete, but no
+        more than twice that many blocks are kept in memory at a time.
+
+        """
+        super(ParallelGzippedOStream, self).__init__(stream, level)
+        threads = threads or cpu_count()
+        self._level = level
+        self._pool = Pool(threads)
+        self._pending = deque()  # compression results in output order
+        self._limit = 2 * threads
+        self._members = 0
+        return
+
+    def close(self):
+        """ Finish the compressed data and close the stream.
+
+        """
+        super(ParallelGzippedOStream, self).close()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        return
+
+    def _compress(self, text):
+        """ Return compressed data for a block of text.
+
+        The block is queued for compression, and the return value is the data
+        for any blocks that have been compressed so far, in order.
+
+        """
+        pending = self._pending
+        if text:
+            pending.append(self._pool.apply_async(_gzip, (text, self._level)))
+            self._members += 1
+        data = []
+        while pending and (len(pending) >= self._limit or pending[0].ready()):
+            # Wait if too many blocks are pending.
+            data.append(pending.popleft().get())
+        return "".join(data)
+
+    def _finish(self):
+        """ Return the remaining compressed data.
+
+        """
+        data = [result.get() for result in self._pending]
+        self._pending.clear()
+        if not self._members:
+            # Empty input still needs a valid gzip member.
+            data.append(_gzip("", self._level))
+        return "".join(data)
+
+
+def _gzip(text, level):
+    """ Compress text as a complete gzip member.
+
+    """
+    # zlib releases the GIL while compressing, so this can be executed in
+    # parallel threads.
+    encoder = compressobj(level, DEFLATED, MAX_WBITS + 16)
+    return encoder.compress(text) + encoder.flush()
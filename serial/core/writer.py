@@ -7,6 +7,7 @@ from __future__ import absolute_import
 
 from contextlib import contextmanager
 
+from ._compile import encoder
 from ._util import Field
 
 __all__ = ("DelimitedWriter", "FixedWidthWriter")
@@ -59,6 +60,19 @@ class _Writer(object):
         self._put(record)
         return
 
+    def write_batch(self, records):
+        """ Write a sequence of records to the output stream.
+
+        Filters are applied to the entire batch of records at a time, one
+        filter after another.
+
+        """
+        for callback in self._filters:
+            records = [record for record in map(callback, records) if
+                       record is not None]
+        self._put_batch(records)
+        return
+
     def dump(self, records):
         """ Write all records to the output stream.
         
@@ -75,6 +89,18 @@ class _Writer(object):
         """
         raise NotImplementedError
 
+    def _put_batch(self, records):
+        """ Write a sequence of records to the output stream.
+
+        This is the batch equivalent of _put(). The default implementation
+        calls _put() for each record, but derived classes can override this
+        with something more efficient.
+
+        """
+        for record in records:
+            self._put(record)
+        return
+
 
 class _TabularWriter(_Writer):
     """ Abstract base class for tabular data writers.
@@ -116,29 +142,54 @@ class _TabularWriter(_Writer):
         self._stream = stream
         self._fields = [Field(*args) for args in fields]
         self._endl = endl
+        self._encode = self._compile()
         return
 
     def _put(self, record):
         """ Write a filtered record to the output stream.
 
         """
-        tokens = []
-        for index, field in enumerate(self._fields):
-            token = field.dtype.encode(record.get(field.name))
-            if isinstance(token, basestring):
-                tokens.append(token)
-            else:
-                # A sequence of tokens (e.g. an ArrayType); expand inline and
-                # update the field width and position based on the actual size
-                # of the field.
-                tokens.extend(token)
-                end = field.pos.start + field.dtype.width
-                field.pos = slice(field.pos.start, end)
-                field.width = field.dtype.width
-                self._fields[index] = field
-        self._stream.write(self._join(tokens) + self._endl)
+        self._stream.write(self._encode(record))
         return
 
+    def _put_batch(self, records):
+        """ Write a sequence of filtered records to the output stream.
+
+        """
+        try:
+            writelines = self._stream.writelines
+        except AttributeError:  # no writelines()
+            return super(_TabularWriter, self)._put_batch(records)
+        writelines(map(self._encode, records))
+        return
+
+    def _compile(self):
+        """ Return a function that encodes a record as a line of text.
+
+        This is called once by the constructor. The default implementation
+        uses _join() to create each line, but derived classes can override
+        this to return a function that is specialized for their field
+        definitions.
+
+        """
+        fields = self._fields
+        join = self._join
+        endl = self._endl
+
+        def encode(record):
+            """ Encode a record using the field definitions. """
+            tokens = []
+            for field in fields:
+                token = field.dtype.encode(record.get(field.name))
+                if isinstance(token, basestring):
+                    tokens.append(token)
+                else:
+                    # A sequence of tokens (e.g. an ArrayType); expand inline.
+                    tokens.extend(token)
+            return join(tokens) + endl
+
+        return encode
+
     def _join(self, tokens):
         """ Join a sequence of tokens into a line of text.
 
@@ -161,10 +212,19 @@ class DelimitedWriter(_TabularWriter):
         the resulting output.
 
         """
+        self._delim = delim  # needed by _compile()
         super(DelimitedWriter, self).__init__(stream, fields, endl)
-        self._delim = delim
         return
 
+    def _compile(self):
+        """ Return a function that encodes a record as a line of text.
+
+        """
+        if self._join.__func__ is not DelimitedWriter._join.__func__:
+            # A derived class has its own _join() implementation.
+            return super(DelimitedWriter, self)._compile()
+        return encoder(self._fields, self._delim, self._endl)
+
     def _join(self, tokens):
         """ Join a sequence of tokens into a line of text.
 
@@ -3,11 +3,19 @@
 The module can be executed on its own or incorporated into a larger test suite.
 
 """
+from datetime import datetime
+from datetime import timedelta
+
 import _path
 import _unittest as unittest
 
 from serial.core.buffer import _ReaderBuffer
 from serial.core.buffer import _WriterBuffer
+from serial.core import AggregateBuffer
+from serial.core import DedupBuffer
+from serial.core import JoinBuffer
+from serial.core import SortBuffer
+from serial.core import WindowBuffer
 
 
 # The library doesn't include any concrete implementations of _ReaderBuffer or
@@ -103,6 +111,27 @@ class MockWriter(object):
         return
 
 
+class MockBatchWriter(MockWriter):
+    """ Simulate a _Writer with batch output for testing purposes.
+
+    """
+    def __init__(self):
+        """ Initialize this object.
+
+        """
+        super(MockBatchWriter, self).__init__()
+        self.batches = []
+        return
+
+    def write_batch(self, records):
+        """ Write a sequence of records.
+
+        """
+        self.batches.append(len(records))
+        self.output.extend(records)
+        return
+
+
 # Define the TestCase classes for this module. Each public component of the
 # module being tested has its own TestCase.
 
@@ -173,8 +202,443 @@ class ReaderBufferTest(_BufferTest):
         self.output = self.output[1:]
         self.test_iter() 
         return
+
+    def test_iter_batches(self):
+        """ Test the iter_batches() method.
+
+        """
+        batches = [list(self.output[:1]), list(self.output[1:])]
+        self.assertSequenceEqual(batches, list(self.buffer.iter_batches(1)))
+        return
+
+    def test_read_batch(self):
+        """ Test the read_batch() method.
+
+        """
+        self.assertSequenceEqual(self.output, self.buffer.read_batch(10))
+        self.assertSequenceEqual([], self.buffer.read_batch(10))
+        return
+
+    def test_read_batch_error(self):
+        """ Test the read_batch() method for an error while reading.
+
+        """
+        class Reader(object):
+            """ A reader that fails while reading a batch. """
+            def read_batch(self, count):
+                """ Raise an AttributeError. """
+                raise AttributeError("error in a filter")
+
+        self.buffer = ReaderBuffer(Reader())
+        with self.assertRaises(AttributeError):
+            self.buffer.read_batch(10)
+        return
     
 
+class SortBufferTest(unittest.TestCase):
+    """ Unit testing for the SortBuffer class.
+
+    """
+    def setUp(self):
+        """ Set up the test fixture.
+
+        This is called before each test is run so that they are isolated from
+        any side effects. This is part of the unittest API.
+
+        """
+        self.fan_in = SortBuffer.fan_in
+        self.input = [{"key": num * 7 % 10, "seq": num} for num in range(50)]
+        self.output = sorted(self.input, key=lambda record: record["key"])
+        return
+
+    def tearDown(self):
+        """ Clean up the test fixture.
+
+        This is called after each test is run. This is part of the unittest
+        API.
+
+        """
+        SortBuffer.fan_in = self.fan_in
+        return
+
+    def test_iter(self):
+        """ Test the iterator protocol.
+
+        """
+        buffer = SortBuffer(iter(self.input), "key")
+        self.assertSequenceEqual(self.output, list(buffer))
+        return
+
+    def test_iter_spill(self):
+        """ Test the iterator protocol with runs spilled to disk.
+
+        """
+        buffer = SortBuffer(iter(self.input), "key", limit=4)
+        self.assertSequenceEqual(self.output, list(buffer))
+        SortBuffer.fan_in = 3  # force multiple merge passes
+        buffer = SortBuffer(iter(self.input), "key", limit=4)
+        self.assertSequenceEqual(self.output, list(buffer))
+        return
+
+    def test_iter_parallel(self):
+        """ Test the iterator protocol with runs sorted by worker processes.
+
+        """
+        buffer = SortBuffer(iter(self.input), "key", processes=2)
+        output = [buffer.next()]
+        self.assertIsNone(buffer._pool)  # nothing was spilled
+        output.extend(buffer)
+        self.assertSequenceEqual(self.output, output)
+        buffer = SortBuffer(iter(self.input), "key", limit=4, processes=2)
+        self.assertSequenceEqual(self.output, list(buffer))
+        return
+
+    def test_key(self):
+        """ Test sorting by multiple fields.
+
+        """
+        for record in self.input:
+            record["mod"] = record["seq"] % 3
+        key = lambda record: (record["key"], record["mod"])
+        self.output.sort(key=key)
+        buffer = SortBuffer(iter(self.input), ("key", "mod"), limit=4)
+        self.assertSequenceEqual(self.output, list(buffer))
+        return
+
+    def test_read_batch(self):
+        """ Test the read_batch() method.
+
+        """
+        buffer = SortBuffer(iter(self.input), "key", limit=4)
+        buffer.filter(lambda record: record if record["seq"] % 2 else None)
+        output = [record for record in self.output if record["seq"] % 2]
+        self.assertSequenceEqual(output, buffer.read_batch(100))
+        return
+
+    def test_close(self):
+        """ Test the close() method.
+
+        """
+        buffer = SortBuffer(iter(self.input), "key", limit=4, processes=2)
+        buffer.next()
+        buffer.close()
+        self.assertSequenceEqual([], list(buffer))
+        return
+
+
+class AggregateBufferTest(unittest.TestCase):
+    """ Unit testing for the AggregateBuffer class.
+
+    """
+    def setUp(self):
+        """ Set up the test fixture.
+
+        This is called before each test is run so that they are isolated from
+        any side effects. This is part of the unittest API.
+
+        """
+        self.input = [{"key": num % 3, "val": num if num % 5 else None} for
+                      num in range(20)]
+        self.aggregates = (
+            ("records", "count"), ("count", "count", "val"),
+            ("sum", "sum", "val"), ("min", "min", "val"),
+            ("max", "max", "val"), ("mean", "mean", "val"),
+            ("first", "first", "val"), ("last", "last", "val"))
+        self.output = [
+            {"key": 0, "records": 7, "count": 5, "sum": 48, "min": 3,
+             "max": 18, "mean": 9.6, "first": None, "last": 18},
+            {"key": 1, "records": 7, "count": 6, "sum": 60, "min": 1,
+             "max": 19, "mean": 10.0, "first": 1, "last": 19},
+            {"key": 2, "records": 6, "count": 5, "sum": 52, "min": 2,
+             "max": 17, "mean": 10.4, "first": 2, "last": 17}]
+        return
+
+    def test_iter(self):
+        """ Test the iterator protocol.
+
+        """
+        buffer = AggregateBuffer(iter(self.input), "key", self.aggregates)
+        output = sorted(buffer, key=lambda record: record["key"])
+        self.assertSequenceEqual(self.output, output)
+        return
+
+    def test_iter_spill(self):
+        """ Test the iterator protocol with groups spilled to disk.
+
+        """
+        buffer = AggregateBuffer(iter(self.input), "key", self.aggregates,
+                                 limit=1)
+        output = sorted(buffer, key=lambda record: record["key"])
+        self.assertSequenceEqual(self.output, output)
+        return
+
+    def test_iter_partition(self):
+        """ Test dividing partitions that have too many groups.
+
+        """
+        def result(key, values):
+            """ Check the table size for each output group. """
+            sizes.append(len(buffer._table))
+            return result_func(key, values)
+
+        self.input = [{"key": num % 500, "val": num} for num in range(2000)]
+        buffer = AggregateBuffer(iter(self.input), "key", self.aggregates[:1],
+                                 limit=10)
+        buffer.partitions = 4  # 500 groups > limit * partitions
+        result_func = buffer._aggregator.result
+        buffer._aggregator.result = result
+        sizes = []
+        output = sorted(buffer, key=lambda record: record["key"])
+        self.assertSequenceEqual([{"key": num, "records": 4} for num in
+                                  range(500)], output)
+        self.assertLessEqual(max(sizes), 10)
+        return
+
+    def test_key(self):
+        """ Test grouping by multiple fields.
+
+        """
+        for record in self.input:
+            record["mod"] = record["key"] % 2
+        key = ("mod", "key")
+        buffer = AggregateBuffer(iter(self.input), key, self.aggregates[:1])
+        output = sorted(buffer, key=lambda record: record["key"])
+        self.assertSequenceEqual([
+            {"mod": 0, "key": 0, "records": 7},
+            {"mod": 1, "key": 1, "records": 7},
+            {"mod": 0, "key": 2, "records": 6}], output)
+        return
+
+    def test_unknown(self):
+        """ Test an unknown aggregate function.
+
+        """
+        with self.assertRaises(ValueError):
+            AggregateBuffer(iter(self.input), "key", (("x", "median", "val"),))
+        return
+
+
+class DedupBufferTest(unittest.TestCase):
+    """ Unit testing for the DedupBuffer class.
+
+    """
+    def setUp(self):
+        """ Set up the test fixture.
+
+        This is called before each test is run so that they are isolated from
+        any side effects. This is part of the unittest API.
+
+        """
+        keys = (1, 2, 1, 3, 4, 2, 5, 1)
+        self.input = [{"key": key, "time": pos} for (pos, key) in
+                      enumerate(keys)]
+        return
+
+    def dedup(self, *args, **kwargs):
+        """ Return the times of the deduplicated records.
+
+        """
+        buffer = DedupBuffer(iter(self.input), "key", *args, **kwargs)
+        return [record["time"] for record in buffer]
+
+    def test_exact(self):
+        """ Test exact mode.
+
+        """
+        self.assertSequenceEqual([0, 1, 3, 4, 6], self.dedup())
+        return
+
+    def test_exact_limit(self):
+        """ Test exact mode with a limited number of keys.
+
+        """
+        # When 5 is seen, the least recently seen key is 1.
+        self.assertSequenceEqual([0, 1, 3, 4, 6, 7], self.dedup(limit=4))
+        return
+
+    def test_exact_window(self):
+        """ Test exact mode with a time window.
+
+        """
+        self.assertSequenceEqual([0, 1, 3, 4, 6, 7],
+                                 self.dedup(window=("time", 4)))
+        return
+
+    def test_key(self):
+        """ Test deduplication by multiple fields.
+
+        """
+        for record in self.input:
+            record["mod"] = record["time"] % 2
+        buffer = DedupBuffer(iter(self.input), ("key", "mod"))
+        self.assertEqual(6, len(list(buffer)))
+        return
+
+    def test_bloom(self):
+        """ Test bloom filter mode.
+
+        """
+        self.assertSequenceEqual([0, 1, 3, 4, 6], self.dedup(rate=0.001))
+        self.input = [{"key": num % 5000, "time": num} for num in
+                      range(10000)]
+        count = len(self.dedup(limit=5000, rate=0.001))
+        self.assertTrue(4990 <= count <= 5000)  # allow for false positives
+        return
+
+
+class JoinBufferTest(unittest.TestCase):
+    """ Unit testing for the JoinBuffer class.
+
+    """
+    def setUp(self):
+        """ Set up the test fixture.
+
+        This is called before each test is run so that they are isolated from
+        any side effects. This is part of the unittest API.
+
+        """
+        self.build = [{"stid": "abc", "elev": 1}, {"stid": "def", "elev": 2},
+                      {"stid": "def", "elev": 3}, {"stid": "jkl", "elev": 4}]
+        self.input = [{"stid": "abc", "temp": 10}, {"stid": "ghi", "temp": 20},
+                      {"stid": "def", "temp": 30}]
+        self.output = [{"stid": "abc", "elev": 1, "temp": 10},
+                       {"stid": "def", "elev": 2, "temp": 30},
+                       {"stid": "def", "elev": 3, "temp": 30}]
+        return
+
+    def join(self, how, limit=1048576):
+        """ Return the sorted output of a join.
+
+        """
+        buffer = JoinBuffer(iter(self.input), iter(self.build), "stid", how,
+                            limit)
+        return sorted(buffer, key=lambda record: (record["stid"],
+                                                  record.get("elev")))
+
+    def test_inner(self):
+        """ Test an inner join.
+
+        """
+        self.assertSequenceEqual(self.output, self.join("inner"))
+        self.assertSequenceEqual(self.output, self.join("inner", 1))
+        return
+
+    def test_left(self):
+        """ Test a left join.
+
+        """
+        self.output.append(self.input[1])
+        self.assertSequenceEqual(self.output, self.join("left"))
+        self.assertSequenceEqual(self.output, self.join("left", 1))
+        return
+
+    def test_anti(self):
+        """ Test an anti join.
+
+        """
+        self.output = self.input[1:2]
+        self.assertSequenceEqual(self.output, self.join("anti"))
+        self.assertSequenceEqual(self.output, self.join("anti", 1))
+        return
+
+    def test_key(self):
+        """ Test joining on multiple fields.
+
+        """
+        for record in self.build + self.input:
+            record["net"] = "x"
+        self.build[0]["net"] = "y"
+        buffer = JoinBuffer(iter(self.input), iter(self.build),
+                            ("net", "stid"))
+        self.assertSequenceEqual([30, 30], [record["temp"] for record in
+                                            buffer])
+        return
+
+    def test_unknown(self):
+        """ Test an unknown join type.
+
+        """
+        with self.assertRaises(ValueError):
+            self.join("outer")
+        return
+
+
+class WindowBufferTest(unittest.TestCase):
+    """ Unit testing for the WindowBuffer class.
+
+    """
+    def setUp(self):
+        """ Set up the test fixture.
+
+        This is called before each test is run so that they are isolated from
+        any side effects. This is part of the unittest API.
+
+        """
+        self.start = datetime(2014, 1, 1)
+        minutes = (0, 1, 5, 3, 9, 10, 12, 31)  # 3 is late, 31 skips a window
+        self.input = [{"time": self.start + timedelta(minutes=minute),
+                       "stid": "abc" if minute % 2 else "def", "val": minute}
+                      for minute in minutes]
+        self.aggregates = (("count", "count"), ("sum", "sum", "val"))
+        return
+
+    def window(self, *args, **kwargs):
+        """ Return the (minute, count, sum) tuples for each output record.
+
+        """
+        buffer = WindowBuffer(iter(self.input), "time", timedelta(minutes=10),
+                              self.aggregates, *args, **kwargs)
+        output = []
+        for record in buffer:
+            delta = record["time"] - self.start
+            minutes = delta.days * 1440 + delta.seconds // 60
+            output.append((minutes, record["count"], record["sum"]))
+        return output
+
+    def test_tumbling(self):
+        """ Test tumbling windows.
+
+        """
+        self.assertSequenceEqual([(0, 5, 18), (10, 2, 22), (30, 1, 31)],
+                                 self.window())
+        return
+
+    def test_sliding(self):
+        """ Test sliding windows.
+
+        """
+        step = timedelta(minutes=5)
+        self.assertSequenceEqual([
+            (-5, 2, 1), (0, 5, 18), (5, 4, 36), (10, 2, 22), (25, 1, 31),
+            (30, 1, 31)], self.window(step=step))
+        return
+
+    def test_lateness(self):
+        """ Test windows with late records.
+
+        """
+        # With no lateness, the record at minute 3 is dropped by the sliding
+        # window that closed at minute 5.
+        step = timedelta(minutes=5)
+        output = self.window(step=step, lateness=timedelta(minutes=2))
+        self.assertEqual((-5, 3, 4), output[0])
+        return
+
+    def test_key(self):
+        """ Test windows grouped by key.
+
+        """
+        self.aggregates = self.aggregates[:1]
+        buffer = WindowBuffer(iter(self.input), "time", timedelta(minutes=10),
+                              self.aggregates, "stid")
+        output = [(record["time"].minute, record["stid"], record["count"]) for
+                  record in buffer]
+        self.assertSequenceEqual([
+            (0, "abc", 4), (0, "def", 1), (10, "def", 2), (30, "abc", 1)],
+            sorted(output))
+        return
+
+
 class WriterBufferTest(_BufferTest):
     """ Unit testing for the WriterBuffer class.
 
@@ -201,6 +665,33 @@ class WriterBufferTest(_BufferTest):
         self.assertSequenceEqual(self.output, self.writer.output)
         return
 
+    def test_write_batch(self):
+        """ Test the write_batch() method.
+
+        """
+        self.buffer.write_batch(self.input[:2])
+        self.buffer.write_batch(self.input[2:])
+        self.buffer.close()
+        self.assertSequenceEqual(self.output, self.writer.output)
+        return
+
+    def test_write_batch_writer(self):
+        """ Test the write_batch() method with a batch destination writer.
+
+        """
+        self.writer = MockBatchWriter()
+        self.buffer = WriterBuffer(self.writer)
+        self.buffer.write_batch(self.input[:2])  # one queued record
+        self.buffer.write_batch(self.input[2:])  # nothing queued
+        self.buffer.close()  # one queued record
+        self.assertSequenceEqual(self.output, self.writer.output)
+        self.assertSequenceEqual([], self.writer.batches)
+        records = [{"int": num} for num in range(8)]
+        self.buffer = WriterBuffer(self.writer)
+        self.buffer.write_batch(records)  # queued records are handed off
+        self.assertSequenceEqual([4], self.writer.batches)
+        return
+
     def test_dump(self):
         """ Test the dump() method.
 
@@ -223,7 +714,9 @@ class WriterBufferTest(_BufferTest):
 
 # Specify the test cases to run for this module (disables automatic discovery).
 
-_TEST_CASES = (ReaderBufferTest, WriterBufferTest)
+_TEST_CASES = (ReaderBufferTest, WriterBufferTest, SortBufferTest,
+               AggregateBufferTest, DedupBufferTest, JoinBufferTest,
+               WindowBufferTest)
 
 def load_tests(loader, tests, pattern):
     """ Define a TestSuite for this module.
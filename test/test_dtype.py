@@ -3,6 +3,7 @@
 The module can be executed on its own or incorporated into a larger test suite.
 
 """
+from StringIO import StringIO
 from datetime import datetime
 
 import _path
@@ -12,8 +13,12 @@ from serial.core import ConstType
 from serial.core import IntType
 from serial.core import FloatType
 from serial.core import StringType
+from serial.core import CategoricalType
 from serial.core import DatetimeType
 from serial.core import ArrayType
+from serial.core import CachedType
+from serial.core import DelimitedReader
+from serial.core import DelimitedWriter
 
 
 # Define the TestCase classes for this module. Each public component of the
@@ -180,6 +185,78 @@ class StringTypeTest(_DataTypeTest):
         return
 
 
+class CategoricalTypeTest(_DataTypeTest):
+    """ Unit testing for the CategoricalType class.
+
+    """
+    def setUp(self):
+        """ Set up the test fixture.
+
+        This is called before each test is run so that they are isolated from
+        any side effects. This is part of the unittest API.
+
+        """
+        self.value = 1
+        self.token = "abc"
+        self.dtype = CategoricalType(categories=("xyz", "abc"))
+        self.default_value = 0
+        self.default_token = "xyz"
+        self.default_dtype = CategoricalType(default="xyz")
+        return
+
+    def test_decode_categories(self):
+        """ Test the decode() method for new categories.
+
+        """
+        tokens = ("def", " abc ", "def", "ghi")
+        self.assertEqual([2, 1, 2, 3], [self.dtype.decode(token) for token in
+                                        tokens])
+        self.assertEqual(["xyz", "abc", "def", "ghi"], self.dtype.categories)
+        return
+
+    def test_value(self):
+        """ Test the value() method.
+
+        """
+        self.assertEqual("abc", self.dtype.value(1))
+        self.assertIsNone(self.dtype.value(None))
+        return
+
+    def test_encode_string(self):
+        """ Test the encode() method for a string.
+
+        """
+        self.assertEqual("def", self.dtype.encode("def"))
+        self.assertEqual("xyz", self.dtype.encode(0))
+        return
+
+    def test_encode_code(self):
+        """ Test the encode() method for integer codes.
+
+        """
+        self.assertEqual("abc", self.dtype.encode(long(1)))
+        with self.assertRaises(ValueError):
+            self.dtype.encode(True)  # not a code
+        return
+
+    def test_round_trip(self):
+        """ Test reading codes and writing them as plain strings.
+
+        """
+        data = "1,abc\n2,def\n3,abc\n4,\n"
+        fields = (("int", 0, IntType()), ("str", 1, self.dtype))
+        records = list(DelimitedReader(StringIO(data), fields, ","))
+        self.assertEqual([1, 2, 1, None], [record["str"] for record in
+                                           records])
+        for record in records:
+            record["str"] = self.dtype.value(record["str"])
+        fields = (("int", 0, IntType()), ("str", 1, StringType()))
+        stream = StringIO()
+        DelimitedWriter(stream, fields, ",").dump(records)
+        self.assertEqual(data, stream.getvalue())
+        return
+
+
 class DatetimeTypeTest(_DataTypeTest):
     """ Unit testing for the DatetimeType class.
 
@@ -200,6 +277,84 @@ class DatetimeTypeTest(_DataTypeTest):
         self.default_dtype = DatetimeType(timefmt, 3, self.default_value)
         return
 
+    def test_decode_formats(self):
+        """ Test the decode() method for various formats.
+
+        """
+        tokens = (
+            ("%Y-%m-%dT%H:%M:%S.%f", "2012-12-31T01:02:03.4"),
+            ("%Y-%m-%dT%H:%M:%S.%f", "2012-1-31T01:02:03.456789"),
+            ("%d/%m/%y %H%M", "31/12/12 0102"),
+            ("%d/%m/%y %H%M", "31/12/99 0102"),
+            ("%H:%M", "01:02"),
+            ("%I:%M %p", "01:02 PM"))  # not compiled
+        for timefmt, token in tokens:
+            value = datetime.strptime(token, timefmt)
+            self.assertEqual(value, DatetimeType(timefmt).decode(token))
+        return
+
+    def test_decode_invalid(self):
+        """ Test the decode() method for invalid input.
+
+        """
+        tokens = ("2012-02-30T00:00:00.000", "2012-12-31T+1:00:00.000",
+                  "2012-12-31T00:00:00.1234567", "2012-12-31")
+        for token in tokens:
+            with self.assertRaises(ValueError):
+                self.dtype.decode(token)
+        tokens = (
+            ("%Y-%m-%dT%H:%M:%S+00:00", "2020-01-01T01:02:03+05:00"),
+            ("%Y%m%d-%H%M%S", "202001011-03000"))
+        for timefmt, token in tokens:
+            with self.assertRaises(ValueError):
+                DatetimeType(timefmt).decode(token)
+        return
+
+    def test_decode_cache(self):
+        """ Test the decode() method for consecutive values from one day.
+
+        """
+        tokens = ("2012-12-31T00:00:00.000", "2012-12-31T12:00:00.000",
+                  "2013-01-01T00:00:00.000")
+        values = [datetime(2012, 12, 31), datetime(2012, 12, 31, 12),
+                  datetime(2013, 1, 1)]
+        self.assertEqual(values, [self.dtype.decode(token) for token in
+                                  tokens])
+        return
+
+    def test_encode_formats(self):
+        """ Test the encode() method for various formats.
+
+        """
+        value = datetime(2012, 12, 31, 13, 2, 3, 456789)
+        formats = ("%Y-%m-%dT%H:%M:%S.%f", "%d/%m/%y %H%M", "%H:%M",
+                   "%I:%M %p", "%Y%m%d", "%Y %%d")
+        for timefmt in formats:
+            token = value.strftime(timefmt)
+            self.assertEqual(token, DatetimeType(timefmt).encode(value))
+        for prec in range(1, 7):
+            dtype = DatetimeType("%S.%f", prec)
+            self.assertEqual("03.456789"[:prec + 3], dtype.encode(value))
+        dtype = DatetimeType("%Y-%m-%d")
+        self.assertEqual("1850-01-02", dtype.encode(datetime(1850, 1, 2)))
+        for hour in (0, 12):
+            value = datetime(2012, 12, 31, hour, 30)
+            token = value.strftime("%I:%M %p")
+            self.assertEqual(token, DatetimeType("%I:%M %p").encode(value))
+        return
+
+    def test_encode_cache(self):
+        """ Test the encode() method for consecutive values from one day.
+
+        """
+        values = (datetime(2012, 12, 31), datetime(2012, 12, 31, 0, 30),
+                  datetime(2012, 12, 31, 12), datetime(2013, 1, 1))
+        tokens = ["2012-12-31T00:00:00.000", "2012-12-31T00:30:00.000",
+                  "2012-12-31T12:00:00.000", "2013-01-01T00:00:00.000"]
+        self.assertEqual(tokens, [self.dtype.encode(value) for value in
+                                  values])
+        return
+
 
 class ArrayTypeTest(_DataTypeTest):
     """ Unit testing for the ArrayType class.
@@ -250,10 +405,100 @@ class ArrayTypeTest(_DataTypeTest):
         return
 
 
+class CachedTypeTest(_DataTypeTest):
+    """ Unit testing for the CachedType class.
+
+    """
+    def setUp(self):
+        """ Set up the test fixture.
+
+        This is called before each test is run so that they are isolated from
+        any side effects. This is part of the unittest API.
+
+        """
+        self.value = "abc"
+        self.token = "abc"
+        self.dtype = CachedType(StringType(), 4)
+        self.default_value = "xyz"
+        self.default_token = "xyz"
+        self.default_dtype = CachedType(StringType(default="xyz"), 4)
+        return
+
+    def test_decode_cache(self):
+        """ Test the decode() method for repeated tokens.
+
+        """
+        tokens = ["abc", " abc", "def", "abc", " abc", "ghi", "jkl", "mno",
+                  "abc"]
+        values = [self.dtype.decode(token) for token in tokens]
+        self.assertEqual([token.strip() for token in tokens], values)
+        self.assertEqual(3, self.dtype.decode_hits)
+        self.assertEqual(6, self.dtype.decode_misses)
+        self.assertTrue(values[0] is values[1])  # interned
+        return
+
+    def test_encode_cache(self):
+        """ Test the encode() method for repeated values.
+
+        """
+        dtype = CachedType(DatetimeType("%Y-%m-%d"), 2)
+        values = [datetime(2012, 12, 31), datetime(2012, 12, 31),
+                  datetime(2013, 1, 1), datetime(2013, 1, 2),
+                  datetime(2012, 12, 31), None]
+        tokens = ["2012-12-31", "2012-12-31", "2013-01-01", "2013-01-02",
+                  "2012-12-31", ""]
+        self.assertEqual(tokens, [dtype.encode(value) for value in values])
+        self.assertEqual(2, dtype.encode_hits)
+        self.assertEqual(4, dtype.encode_misses)
+        return
+
+    def test_encode_types(self):
+        """ Test the encode() method for equal values of different types.
+
+        """
+        dtype = CachedType(StringType(""), 4)
+        values = (1, 1.0, True, 1)
+        self.assertEqual(["1", "1.0", "True", "1"],
+                         [dtype.encode(value) for value in values])
+        self.assertEqual(1, dtype.encode_hits)
+        return
+
+    def test_disable(self):
+        """ Test disabling the cache for a low hit rate.
+
+        """
+        for num in range(CachedType._sample):
+            self.dtype.decode(str(num))
+        self.assertEqual(CachedType._sample, self.dtype.decode_misses)
+        self.assertEqual("abc", self.dtype.decode("abc"))
+        self.assertEqual("abc", self.dtype.decode("abc"))
+        self.assertEqual(0, self.dtype.decode_hits)
+        return
+
+    def test_disable_compiled(self):
+        """ Test disabling the cache for a compiled reader and writer.
+
+        """
+        count = CachedType._sample * 2
+        fields = (("int", 0, self.dtype),)
+        stream = StringIO("".join("{0:d}\n".format(num) for num in
+                                  range(count)))
+        records = list(DelimitedReader(stream, fields, ","))
+        self.assertEqual([str(num) for num in range(count)],
+                         [record["int"] for record in records])
+        self.assertEqual(CachedType._sample, self.dtype.decode_misses)
+        stream = StringIO()
+        DelimitedWriter(stream, fields, ",").dump(records)
+        self.assertEqual(count, len(stream.getvalue().split()))
+        self.assertEqual(CachedType._sample, self.dtype.encode_misses)
+        return
+
+
 # Specify the test cases to run for this module (disables automatic discovery).
 
 _TEST_CASES = (ConstTypeTest, IntTypeTest, FloatTypeTest, StringTypeTest,
-               DatetimeTypeTest, ArrayTypeTest)
+               CategoricalTypeTest, DatetimeTypeTest, ArrayTypeTest,
+               CachedTypeTest)
 
 def load_tests(loader, tests, pattern):
     """ Define a TestSuite for this module.
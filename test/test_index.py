@@ -0,0 +1,125 @@
+""" Testing for the the index.py module
+
+The module can be executed on its own or incorporated into a larger test suite.
+
+"""
+from contextlib import closing
+from gzip import GzipFile
+from io import BytesIO
+from random import Random
+
+import _path
+import _unittest as unittest
+
+from serial.core import GzipIndex
+from serial.core import GzippedIStream
+
+
+# Define the TestCase classes for this module. Each public component of the
+# module being tested has its own TestCase.
+
+class GzipIndexTest(unittest.TestCase):
+    """ Unit testing for the GzipIndex class.
+
+    """
+    def setUp(self):
+        """ Set up the test fixture.
+
+        This is called before each test is run so that they are isolated from
+        any side effects. This is part of the unittest API.
+
+        """
+        # Use pseudorandom data so that the compressed data has many dynamic
+        # Huffman blocks.
+        random = Random(1)
+        self.lines = ["{0:d},{1:.6f}\n".format(num, random.random()) for num
+                      in range(30000)]
+        self.text = "".join(self.lines)
+        self.stream = BytesIO()
+        for beg, end in ((0, 12000), (12000, None)):
+            # Write two gzip members.
+            with closing(GzipFile(fileobj=self.stream, mode="w")) as stream:
+                stream.write("".join(self.lines[beg:end]))
+        self.index = GzipIndex.build(self.stream, 32768)
+        return
+
+    def test_build(self):
+        """ Test the build() method.
+
+        """
+        self.assertGreater(len(self.index), 5)
+        self.assertEqual(len(self.text), self.index.size)
+        self.assertEqual(len(self.lines), self.index.lines)
+        return
+
+    def test_save(self):
+        """ Test the save() and load() methods.
+
+        """
+        stream = BytesIO()
+        self.index.save(stream)
+        stream.seek(0)
+        index = GzipIndex.load(stream)
+        self.assertEqual(len(self.index), len(index))
+        self.assertEqual(self.index.size, index.size)
+        self.assertEqual(self.index.lines, index.lines)
+        self.index = index
+        self.test_stream_line()
+        return
+
+    def test_locate(self):
+        """ Test the locate() method.
+
+        """
+        self.assertIsNone(self.index.locate(line=0))
+        point = self.index.locate(line=20000)
+        self.assertLess(point.line, 20000)
+        self.assertEqual(point, self.index.locate(offset=point.offset))
+        return
+
+    def test_stream_line(self):
+        """ Test a GzippedIStream starting at a line.
+
+        """
+        for line in (0, 1, 10000, 12000, 29999):
+            stream = GzippedIStream(self.stream, self.index, line=line)
+            self.assertEqual(self.lines[line], stream.next())
+        stream = GzippedIStream(self.stream, self.index, line=20000)
+        self.assertSequenceEqual(self.lines[20000:], list(stream))
+        stream = GzippedIStream(self.stream, self.index)
+        self.assertSequenceEqual(self.lines, list(stream))
+        return
+
+    def test_stream_offset(self):
+        """ Test a GzippedIStream starting at a byte offset.
+
+        """
+        for offset in (0, 5, len(self.text) // 3, len(self.text) - 1):
+            stream = GzippedIStream(self.stream, self.index, offset=offset)
+            self.assertEqual(self.text[offset:], "".join(stream))
+        return
+
+
+# Specify the test cases to run for this module (disables automatic discovery).
+
+_TEST_CASES = (GzipIndexTest,)
+
+def load_tests(loader, tests, pattern):
+    """ Define a TestSuite for this module.
+
+    This is part of the unittest API. The last two arguments are ignored. The
+    _TEST_CASES global is used to determine which TestCase classes to load
+    from this module.
+
+    """
+    suite = unittest.TestSuite()
+    for test_case in _TEST_CASES:
+        tests = loader.loadTestsFromTestCase(test_case)
+        suite.addTests(tests)
+    return suite
+
+
+# Make the module executable.
+
+if __name__ == "__main__":
+    unittest.main()  # main() calls sys.exit()
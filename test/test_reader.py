@@ -4,17 +4,39 @@ The module can be executed on its own or incorporated into a larger test suite.
 
 """
 from StringIO import StringIO
+from bz2 import compress as bz2_compress
+from contextlib import closing
+from gzip import GzipFile
+from os import mkfifo
+from os import remove
+from os import rmdir
+from os.path import dirname
+from os.path import join
+from tempfile import NamedTemporaryFile
+from tempfile import TemporaryFile
+from tempfile import mkdtemp
+from threading import Thread
 
 import _path
 import _unittest as unittest
 
 from functools import partial
 
+try:
+    import numpy
+except ImportError:  # NumPy is optional
+    numpy = None
+
 from serial.core import DelimitedReader
 from serial.core import FixedWidthReader
+from serial.core import MappedFixedWidthReader
+from serial.core import MergeReader
+from serial.core import ParallelReader
 from serial.core import ReaderSequence
 from serial.core import IntType
+from serial.core import FloatType
 from serial.core import StringType
+from serial.core import CategoricalType
 from serial.core import ArrayType
 
 
@@ -77,6 +99,58 @@ class _TabularReaderTest(unittest.TestCase):
         self.assertTrue(self.stream)
         return
 
+    def test_open_compressed(self):
+        """ Test the open() method for a compressed file.
+
+        """
+        with NamedTemporaryFile("wb", delete=False) as stream:
+            stream.write(bz2_compress(self.data))
+        try:
+            with self.TestClass.open(stream.name, *self.args) as self.reader:
+                self.test_iter()
+        finally:
+            remove(stream.name)
+        return
+
+    def test_open_text(self):
+        """ Test the open() method for a text file that looks compressed.
+
+        """
+        with NamedTemporaryFile("w", delete=False) as stream:
+            stream.write("BZh" + self.data)  # not a complete bzip2 header
+        try:
+            with self.TestClass.open(stream.name, *self.args) as self.reader:
+                # A regular text file is opened as a builtin file.
+                self.assertIs(file, type(self.reader._stream))
+                self.assertEqual(2, len(list(self.reader)))
+        finally:
+            remove(stream.name)
+        return
+
+    def test_open_fifo(self):
+        """ Test the open() method for a named pipe.
+
+        """
+        def write():
+            """ Write the test data to the pipe. """
+            with open(path, "w") as stream:
+                stream.write(self.data)
+            return
+
+        path = join(mkdtemp(), "fifo")
+        mkfifo(path)
+        thread = Thread(target=write)
+        thread.daemon = True
+        thread.start()
+        try:
+            with self.TestClass.open(path, *self.args) as self.reader:
+                self.test_iter()
+        finally:
+            thread.join()
+            remove(path)
+            rmdir(dirname(path))
+        return
+
     def test_next(self):
         """ Test the next() method.
 
@@ -110,6 +184,94 @@ class _TabularReaderTest(unittest.TestCase):
         self.test_iter()
         return
 
+    def test_read_batch(self):
+        """ Test the read_batch() method.
+
+        """
+        self.assertSequenceEqual(self.records[:1], self.reader.read_batch(1))
+        self.assertSequenceEqual(self.records[1:], self.reader.read_batch(5))
+        self.assertSequenceEqual([], self.reader.read_batch(5))
+        return
+
+    def test_iter_batches(self):
+        """ Test the iter_batches() method.
+
+        """
+        batches = [self.records[:1], self.records[1:]]
+        self.assertSequenceEqual(batches, list(self.reader.iter_batches(1)))
+        return
+
+    def test_iter_batches_filter(self):
+        """ Test the iter_batches() method with filters.
+
+        """
+        self.records = self.records[1:]
+        self.records[0]["int"] = 912
+        self.reader.filter(reject_filter, modify_filter)
+        batches = [self.records]
+        self.assertSequenceEqual(batches, list(self.reader.iter_batches(5)))
+        return
+
+    def test_iter_batches_stop(self):
+        """ Test the iter_batches() method with a filter that stops iteration.
+
+        """
+        self.reader.filter(stop_filter)
+        batches = [self.records[:1]]
+        self.assertSequenceEqual(batches, list(self.reader.iter_batches(5)))
+        return
+
+    def test_read_columns(self):
+        """ Test the read_columns() method.
+
+        """
+        columns = self.reader.read_columns(5)
+        self.assertSequenceEqual(["arr", "int"], sorted(columns))
+        self.assertSequenceEqual([123, 456], list(columns["int"]))
+        self.assertNotIsInstance(columns["int"], list)  # typed array
+        arrays = [record["arr"] for record in self.records]
+        self.assertSequenceEqual(arrays, columns["arr"])
+        self.assertEqual({}, self.reader.read_columns(5))
+        return
+
+    def test_iter_columns_filter(self):
+        """ Test the iter_columns() method with filters.
+
+        """
+        self.reader.filter(reject_filter, modify_filter)
+        batches = list(self.reader.iter_columns(1))
+        self.assertEqual(1, len(batches))
+        self.assertSequenceEqual([912], list(batches[0]["int"]))
+        return
+
+    def test_read_columns_default(self):
+        """ Test the read_columns() method for blank fields.
+
+        """
+        self.stream = StringIO(self.default_data)
+        self.reader = self.TestClass(self.stream, *self.default_args)
+        columns = self.reader.read_columns(5)
+        self.assertSequenceEqual([123, -999], list(columns["int"]))
+        return
+
+    def test_default(self):
+        """ Test the decoding of blank fields.
+
+        """
+        self.records[1]["int"] = -999
+        self.stream = StringIO(self.default_data)
+        self.reader = self.TestClass(self.stream, *self.default_args)
+        self.test_iter()
+        return
+
+    def test_compile(self):
+        """ Test that readers with the same fields share a decoder.
+
+        """
+        reader = self.TestClass(self.stream, *self.args)
+        self.assertIs(self.reader._decode, reader._decode)
+        return
+
 
 class DelimitedReaderTest(_TabularReaderTest):
     """ Unit testing for the DelimitedReader class.
@@ -130,11 +292,57 @@ class DelimitedReaderTest(_TabularReaderTest):
         fields = (
             ("int", 0, IntType()),
             ("arr", (1, None), ArrayType(array_fields))) 
+        default_fields = (
+            ("int", 0, IntType(default=-999)),
+            ("arr", (1, None), ArrayType(array_fields))) 
         self.data = "123, abc, def\n456, ghi, jkl\n"
+        self.default_data = "123, abc, def\n   , ghi, jkl\n"
         super(DelimitedReaderTest, self).setUp()
         self.args = (fields, ",")
+        self.default_args = (default_fields, ",")
         self.reader = self.TestClass(self.stream, *self.args)
         return
+
+    def test_read_batch_error(self):
+        """ Test the read_batch() method for an error in the stream.
+
+        """
+        class Stream(object):
+            """ A stream that fails after the first line. """
+            def __init__(self, line):
+                """ Initialize this object. """
+                self._lines = iter((line,))
+                return
+
+            def __iter__(self):
+                """ Return an iterator. """
+                return self
+
+            def next(self):
+                """ Return the first line, then raise a TypeError. """
+                try:
+                    return self._lines.next()
+                except StopIteration:
+                    raise TypeError("error in the stream")
+
+        line = self.data.splitlines(True)[0]
+        self.reader = self.TestClass(Stream(line), *self.args)
+        with self.assertRaises(TypeError):
+            self.reader.read_batch(10)
+        return
+
+    def test_categorical(self):
+        """ Test the decoding of CategoricalType fields.
+
+        """
+        dtype = CategoricalType(quote="\"", default="M")
+        fields = (("int", 0, IntType()), ("cat", 1, dtype))
+        self.stream = StringIO("1, \"a\"\n2, b\n3,  \n4, a\n")
+        self.reader = self.TestClass(self.stream, fields, ",")
+        self.assertEqual([0, 1, 2, 0], [record["cat"] for record in
+                                        self.reader])
+        self.assertEqual(["a", "b", "M"], dtype.categories)
+        return
         
 
 class FixedWidthReaderTest(_TabularReaderTest):
@@ -156,12 +364,334 @@ class FixedWidthReaderTest(_TabularReaderTest):
         fields = (
             ("int", (0, 3), IntType("3d")),
             ("arr", (3, None), ArrayType(array_fields))) 
+        default_fields = (
+            ("int", (0, 3), IntType("3d", -999)),
+            ("arr", (3, None), ArrayType(array_fields))) 
         self.data = "123abcdef\n456ghijkl\n"
+        self.default_data = "123abcdef\n   ghijkl\n"
         super(FixedWidthReaderTest, self).setUp()
         self.args = (fields,)
+        self.default_args = (default_fields,)
         self.reader = self.TestClass(self.stream, *self.args)
         return
 
+    @unittest.skipIf(numpy is None, "requires NumPy")
+    def test_read_columns_numeric(self):
+        """ Test the read_columns() method for numeric fields.
+
+        """
+        fields = (
+            ("int", (0, 4), IntType("4d", -999)),
+            ("float", (4, 9), FloatType("5.1f")),
+            ("str", 9, StringType("s")))
+        data = " 123 -1.5a\n-4561e+03b\n  x    0.c\n    12.25d\n"
+        reader = self.TestClass(StringIO(data), fields)
+        columns = reader.read_columns(5)
+        self.assertSequenceEqual([123, -456, -999, -999],
+                                 columns["int"].tolist())
+        self.assertSequenceEqual([-1.5, 1000., 0., 12.25],
+                                 columns["float"].tolist())
+        self.assertSequenceEqual(list("abcd"), columns["str"])
+        data = "   1  2.5a\n  23  2.5bc\n"  # unequal line lengths
+        reader = self.TestClass(StringIO(data), fields)
+        columns = reader.read_columns(5)
+        self.assertSequenceEqual([1, 23], columns["int"].tolist())
+        self.assertSequenceEqual([2.5, 2.5], columns["float"].tolist())
+        return
+
+
+class MappedFixedWidthReaderTest(unittest.TestCase):
+    """ Unit testing for the MappedFixedWidthReader class.
+
+    """
+    def setUp(self):
+        """ Set up the test fixture.
+
+        This is called before each test is run so that they are isolated from
+        any side effects. This is part of the unittest API.
+
+        """
+        self.fields = (
+            ("int", (0, 3), IntType("3d")),
+            ("str", (3, 6), StringType("3s")))
+        self.records = [{"int": 100 + num, "str": "x{0:d}".format(num)} for
+                        num in range(10)]
+        self.stream = self.open("".join("{0:3d}x{1:<2d}\n".format(100 + num,
+                                        num) for num in range(10)))
+        self.reader = MappedFixedWidthReader(self.stream, self.fields)
+        return
+
+    def tearDown(self):
+        """ Clean up the test fixture.
+
+        This is called after each test is run. This is part of the unittest
+        API.
+
+        """
+        self.reader.close()
+        self.stream.close()
+        return
+
+    @staticmethod
+    def open(data):
+        """ Return a temporary file containing data.
+
+        """
+        stream = TemporaryFile("w+")
+        stream.write(data)
+        stream.flush()
+        stream.seek(0)
+        return stream
+
+    def test_len(self):
+        """ Test the __len__() method.
+
+        """
+        self.assertEqual(10, len(self.reader))
+        return
+
+    def test_getitem(self):
+        """ Test the __getitem__() method.
+
+        """
+        self.assertEqual(self.records[4], self.reader[4])
+        self.assertEqual(self.records[-1], self.reader[-1])
+        self.assertSequenceEqual(self.records[3:9:2], self.reader[3:9:2])
+        with self.assertRaises(IndexError):
+            self.reader[10]
+        return
+
+    def test_iter(self):
+        """ Test the __iter__() method.
+
+        """
+        self.assertSequenceEqual(self.records, list(self.reader))
+        return
+
+    def test_iter_range(self):
+        """ Test the iter_range() method.
+
+        """
+        self.reader.filter(lambda record: record if record["int"] % 2 else
+                           None)
+        records = self.records[5:9:2]
+        self.assertSequenceEqual(records, list(self.reader.iter_range(4, 9)))
+        self.assertSequenceEqual(self.records[:4], self.reader[:4])
+        return
+
+    def test_read_columns(self):
+        """ Test the read_columns() method.
+
+        """
+        self.reader.next()
+        columns = self.reader.read_columns(3)
+        self.assertSequenceEqual([101, 102, 103], list(columns["int"]))
+        self.assertSequenceEqual(self.records[4:], list(self.reader))
+        return
+
+    def test_no_endl(self):
+        """ Test reading a file without a trailing line ending.
+
+        """
+        stream = self.open("123abc\n456def")
+        reader = MappedFixedWidthReader(stream, self.fields)
+        self.assertEqual({"int": 456, "str": "def"}, reader[1])
+        return
+
+    def test_empty(self):
+        """ Test reading an empty file.
+
+        """
+        reader = MappedFixedWidthReader(self.open(""), self.fields)
+        self.assertEqual(0, len(reader))
+        self.assertSequenceEqual([], list(reader))
+        return
+
+    def test_line_length(self):
+        """ Test that inconsistent line lengths are detected.
+
+        """
+        with self.assertRaises(ValueError):
+            MappedFixedWidthReader(self.open("123abc\n45de\n"), self.fields)
+        return
+
+    def test_open(self):
+        """ Test the open() method.
+
+        """
+        with NamedTemporaryFile("w", delete=False) as stream:
+            stream.write(self.stream.read())
+        try:
+            with MappedFixedWidthReader.open(stream.name, self.fields) as \
+                    reader:
+                self.assertSequenceEqual(self.records, reader[:])
+            self.assertIsNone(reader._map)
+        finally:
+            remove(stream.name)
+        return
+
+    def test_invalid(self):
+        """ Test that compressed files and other streams are rejected.
+
+        """
+        with NamedTemporaryFile("wb", delete=False) as stream:
+            with closing(GzipFile(fileobj=stream, mode="w")) as gzipped:
+                gzipped.write(self.stream.read())
+        try:
+            with self.assertRaises(ValueError):
+                with MappedFixedWidthReader.open(stream.name, self.fields):
+                    pass
+        finally:
+            remove(stream.name)
+        with self.assertRaises(ValueError):
+            MappedFixedWidthReader(StringIO("123abc\n"), self.fields)
+        return
+
+
+class MergeReaderTest(unittest.TestCase):
+    """ Unit testing for the MergeReader class.
+
+    """
+    def setUp(self):
+        """ Set up the test fixture.
+
+        This is called before each test is run so that they are isolated from
+        any side effects. This is part of the unittest API.
+
+        """
+        fields = (("int", 0, IntType()), ("str", 1, StringType()))
+        self.reader = partial(DelimitedReader, fields=fields, delim=",")
+        self.data = ("1,a\n3,a\n5,a\n", "2,b\n3,b\n", "", "0,c\n6,c\n")
+        self.records = [{"int": 0, "str": "c"}, {"int": 1, "str": "a"},
+                        {"int": 2, "str": "b"}, {"int": 3, "str": "a"},
+                        {"int": 3, "str": "b"}, {"int": 5, "str": "a"},
+                        {"int": 6, "str": "c"}]
+        return
+
+    def test_iter(self):
+        """ Test the __iter__() method.
+
+        """
+        readers = [self.reader(StringIO(data)) for data in self.data]
+        merged = MergeReader("int", *readers)
+        self.assertSequenceEqual(self.records, list(merged))
+        return
+
+    def test_iter_streams(self):
+        """ Test the __iter__() method with streams.
+
+        """
+        streams = [StringIO(data) for data in self.data]
+        merged = MergeReader("int", reader=self.reader, *streams)
+        self.assertSequenceEqual(self.records, list(merged))
+        self.assertTrue(all(stream.closed for stream in streams))
+        return
+
+    def test_iter_paths(self):
+        """ Test the __iter__() method with paths.
+
+        """
+        paths = []
+        try:
+            for data in self.data:
+                with NamedTemporaryFile("w", delete=False) as stream:
+                    stream.write(data)
+                paths.append(stream.name)
+            with MergeReader("int", reader=self.reader, *paths) as merged:
+                self.assertSequenceEqual(self.records, list(merged))
+        finally:
+            for path in paths:
+                remove(path)
+        return
+
+    def test_key(self):
+        """ Test merging with a key function.
+
+        """
+        key = lambda record: -record["int"]
+        readers = [self.reader(StringIO(data)) for data in self.data]
+        readers = [list(reader)[::-1] for reader in readers]
+        merged = MergeReader(key, *[iter(reader) for reader in readers])
+        self.records.sort(key=key)
+        self.assertSequenceEqual(self.records, list(merged))
+        return
+
+
+class ParallelReaderTest(unittest.TestCase):
+    """ Unit testing for the ParallelReader class.
+
+    """
+    def setUp(self):
+        """ Set up the test fixture.
+
+        This is called before each test is run so that they are isolated from
+        any side effects. This is part of the unittest API.
+
+        """
+        fields = (
+            ("int", 0, IntType()),
+            ("str", 1, StringType()))
+        self.reader = partial(DelimitedReader, fields=fields, delim=",")
+        self.records = [{"int": num, "str": "abc"} for num in range(100)]
+        with NamedTemporaryFile("w", delete=False) as stream:
+            stream.writelines("{0:d},abc\n".format(num) for num in range(100))
+        self.path = stream.name
+        return
+
+    def tearDown(self):
+        """ Clean up the test fixture.
+
+        This is called after each test is run. This is part of the unittest
+        API.
+
+        """
+        remove(self.path)
+        return
+
+    def test_iter(self):
+        """ Test the __iter__() method.
+
+        """
+        reader = ParallelReader(self.reader, self.path, 2, 16)
+        self.assertSequenceEqual(self.records, list(reader))
+        return
+
+    def test_iter_batches(self):
+        """ Test the iter_batches() method.
+
+        """
+        reader = ParallelReader(self.reader, self.path, 2, 100)
+        records = sum(reader.iter_batches(7), [])
+        self.assertSequenceEqual(self.records, records)
+        return
+
+    def test_filter(self):
+        """ Test the filter() method.
+
+        """
+        def stop(record):
+            """ Stop iteration at the 50th record. """
+            if record["int"] == 50:
+                raise StopIteration
+            return record
+
+        with ParallelReader(self.reader, self.path, 2, 16) as reader:
+            reader.filter(stop)
+            self.assertSequenceEqual(self.records[:50], list(reader))
+        return
+
+    def test_window(self):
+        """ Test that only a limited number of chunks are pending.
+
+        """
+        with ParallelReader(self.reader, self.path, 2, 16) as reader:
+            records = []
+            for record in reader:
+                self.assertLessEqual(len(reader._results), 4)
+                records.append(record)
+            self.assertSequenceEqual(self.records, records)
+        return
+
 
 class ReaderSequenceTest(unittest.TestCase):
     
@@ -197,6 +727,78 @@ class ReaderSequenceTest(unittest.TestCase):
         self.assertTrue(all(stream.closed for stream in self.streams))
         return
         
+    def test_iter_batches(self):
+        """ Test the iter_batches() method.
+
+        """
+        sequence = ReaderSequence(self.reader, *self.streams)
+        batches = [list(self.records[:3]), list(self.records[3:])]
+        self.assertSequenceEqual(batches, list(sequence.iter_batches(3)))
+        self.assertTrue(all(stream.closed for stream in self.streams))
+        return
+
+    def test_iter_prefetch(self):
+        """ Test the __iter__() method with prefetching.
+
+        """
+        paths = []
+        for stream in self.streams * 2:
+            with NamedTemporaryFile("w", delete=False) as output:
+                output.write(stream.getvalue())
+            paths.append(output.name)
+        try:
+            sequence = ReaderSequence(self.reader, *paths, prefetch=2)
+            self.assertSequenceEqual(self.records * 2, list(sequence))
+        finally:
+            for path in paths:
+                remove(path)
+        return
+
+    def test_iter_compressed(self):
+        """ Test the __iter__() method for compressed files.
+
+        """
+        paths = []
+        for stream in self.streams:
+            with NamedTemporaryFile("wb", delete=False) as output:
+                with closing(GzipFile(fileobj=output, mode="w")) as gzipped:
+                    gzipped.write(stream.getvalue())
+            paths.append(output.name)
+        try:
+            for prefetch in (0, 1):
+                sequence = ReaderSequence(self.reader, *paths,
+                                          prefetch=prefetch)
+                self.assertSequenceEqual(self.records, list(sequence))
+        finally:
+            for path in paths:
+                remove(path)
+        return
+
+    def test_iter_empty(self):
+        """ Test iteration with an empty reader in the sequence.
+
+        """
+        # An empty MappedFixedWidthReader has a length of 0, so it is false in
+        # a boolean context.
+        fields = (("int", (0, 3), IntType("3d")),)
+        reader = partial(MappedFixedWidthReader, fields=fields)
+        for count in (None, 2):
+            streams = []
+            for data in ("123\n456\n", "", "789\n"):
+                stream = TemporaryFile("w+")
+                stream.write(data)
+                stream.flush()
+                stream.seek(0)
+                streams.append(stream)
+            sequence = ReaderSequence(reader, *streams)
+            if count is None:
+                records = list(sequence)
+            else:
+                records = sum(sequence.iter_batches(count), [])
+            self.assertEqual([123, 456, 789], [record["int"] for record in
+                                               records])
+        return
+
     def test_iter_context(self):
         """ Test the __iter__() method inside a context block.
         
@@ -209,7 +811,9 @@ class ReaderSequenceTest(unittest.TestCase):
 
 # Specify the test cases to run for this module (disables automatic discovery).
 
-_TEST_CASES = (DelimitedReaderTest, FixedWidthReaderTest, ReaderSequenceTest)
+_TEST_CASES = (DelimitedReaderTest, FixedWidthReaderTest,
+               MappedFixedWidthReaderTest, MergeReaderTest, ParallelReaderTest,
+               ReaderSequenceTest)
 
 def load_tests(loader, tests, pattern):
     """ Define a TestSuite for this module.
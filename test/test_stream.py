@@ -10,16 +10,29 @@ from StringIO import StringIO
 from os import remove
 from tempfile import NamedTemporaryFile
 
+from bz2 import compress as bz2_compress
 from zlib import compress
 from zlib import decompress
 
+try:
+    from lzma import compress as xz_compress
+except ImportError:
+    try:
+        from backports.lzma import compress as xz_compress
+    except ImportError:  # xz support is optional
+        xz_compress = None
+
 import _path
 import _unittest as unittest
 
 from serial.core import BufferedIStream
+from serial.core import Bzip2IStream
 from serial.core import FilteredIStream
 from serial.core import FilteredOStream
 from serial.core import GzippedIStream
+from serial.core import GzippedOStream
+from serial.core import ParallelGzippedOStream
+from serial.core import XzIStream
 
 
 # Define the TestCase classes for this module. Each public component of the
@@ -66,6 +79,21 @@ class BufferedIStreamTest(unittest.TestCase):
         self.assertSequenceEqual([], list(self.stream))  # stream is exhausted
         return
 
+    def test_mark(self):
+        """ Test the mark() and reset() methods.
+
+        """
+        self.stream.next()
+        self.stream.mark()
+        self.assertSequenceEqual(self.lines[1:], list(self.stream))
+        self.stream.reset()  # look-ahead is not limited by bufsize
+        self.assertSequenceEqual(self.lines[1:], list(self.stream))
+        self.stream.rewind()  # buffer is back to its normal size
+        self.assertSequenceEqual(self.lines[-self.bufsize:], list(self.stream))
+        with self.assertRaises(ValueError):
+            self.stream.reset()  # mark was cleared
+        return
+
     def test_close(self):
         """ Test the close method.
         
@@ -172,6 +200,17 @@ class FilteredOStreamTest(unittest.TestCase):
             stream.write(line)
         self.assertEqual(self.data, self.buffer.getvalue())
         return
+
+    def test_writelines(self):
+        """ Test the writelines() method.
+        
+        """
+        reject_filter = lambda line: line if line[0] != "d" else None
+        modify_filter = lambda line: line.upper()
+        stream = FilteredOStream(self.buffer, reject_filter, modify_filter)
+        stream.writelines(self.lines)
+        self.assertEqual(self.data, self.buffer.getvalue())
+        return
         
     def test_close(self):
         """ Test the close() method.
@@ -205,7 +244,8 @@ class GzippedIStreamTest(unittest.TestCase):
         """
         # Test blank lines, lines longer, shorter, and equal to the block size,
         # and no trailing \n.
-        GzippedIStream.block_size = 4
+        self.read_size = GzippedIStream.read_size
+        GzippedIStream.read_size = 4
         self.lines = ("\n", "abcdefgh\n", "ijkl")
         self.zlib_stream = BytesIO(compress("".join(self.lines)))
         self.gzip_stream = BytesIO()
@@ -216,6 +256,16 @@ class GzippedIStreamTest(unittest.TestCase):
         self.gzip_stream.seek(0)  # rewind for reading
         return
 
+    def tearDown(self):
+        """ Clean up the test fixture.
+
+        This is called after each test is run. This is part of the unittest
+        API.
+
+        """
+        GzippedIStream.read_size = self.read_size
+        return
+
     def test_iter_gzip(self):
         """ Test the iterator protocol for gzip data.
         
@@ -232,6 +282,40 @@ class GzippedIStreamTest(unittest.TestCase):
         self.assertSequenceEqual(self.lines, list(stream))
         return
 
+    def test_iter_members(self):
+        """ Test the iterator protocol for multiple gzip members.
+
+        """
+        data = self.gzip_stream.getvalue()
+        stream = GzippedIStream(BytesIO(data * 2))
+        lines = list(self.lines)
+        lines[-1] += lines[0]  # the first member is missing a trailing \n
+        lines.extend(self.lines[1:])
+        self.assertSequenceEqual(lines, list(stream))
+        return
+
+    def test_readlines(self):
+        """ Test the readlines() method.
+
+        """
+        stream = GzippedIStream(self.gzip_stream)
+        self.assertEqual(self.lines[0], stream.next())
+        self.assertSequenceEqual(self.lines[1:], stream.readlines())
+        self.assertSequenceEqual([], stream.readlines())
+        return
+
+    def test_readlines_sizehint(self):
+        """ Test the readlines() method with a size hint.
+
+        """
+        stream = GzippedIStream(self.gzip_stream)
+        lines = stream.readlines(1)
+        self.assertTrue(lines)
+        lines.extend(stream.readlines(1))
+        lines.extend(stream.readlines())
+        self.assertSequenceEqual(self.lines, lines)
+        return
+
     def test_close(self):
         """ Test the close method.
         
@@ -251,10 +335,171 @@ class GzippedIStreamTest(unittest.TestCase):
         return
 
 
+class Bzip2IStreamTest(unittest.TestCase):
+    """ Unit testing for the Bzip2IStream class.
+
+    """
+    TestClass = Bzip2IStream
+
+    def setUp(self):
+        """ Set up the test fixture.
+
+        This is called before each test is run so that they are isolated from
+        any side effects. This is part of the unittest API.
+
+        """
+        self.read_size = self.TestClass.read_size
+        self.TestClass.read_size = 4
+        self.lines = ("\n", "abcdefgh\n", "ijkl\n")
+        self.data = self.compress("".join(self.lines))
+        return
+
+    def tearDown(self):
+        """ Clean up the test fixture.
+
+        This is called after each test is run. This is part of the unittest
+        API.
+
+        """
+        self.TestClass.read_size = self.read_size
+        return
+
+    @staticmethod
+    def compress(text):
+        """ Compress text.
+
+        """
+        return bz2_compress(text)
+
+    def test_iter(self):
+        """ Test the iterator protocol.
+
+        """
+        stream = self.TestClass(BytesIO(self.data))
+        self.assertSequenceEqual(self.lines, list(stream))
+        return
+
+    def test_iter_multi(self):
+        """ Test the iterator protocol for concatenated streams.
+
+        """
+        stream = self.TestClass(BytesIO(self.data * 2))
+        self.assertSequenceEqual(self.lines * 2, list(stream))
+        return
+
+
+@unittest.skipIf(xz_compress is None, "requires lzma")
+class XzIStreamTest(Bzip2IStreamTest):
+    """ Unit testing for the XzIStream class.
+
+    """
+    TestClass = XzIStream
+
+    @staticmethod
+    def compress(text):
+        """ Compress text.
+
+        """
+        return xz_compress(text)
+
+
+class GzippedOStreamTest(unittest.TestCase):
+    """ Unit testing for the GzippedOStream class.
+
+    """
+    TestClass = GzippedOStream
+
+    def setUp(self):
+        """ Set up the test fixture.
+
+        This is called before each test is run so that they are isolated from
+        any side effects. This is part of the unittest API.
+
+        """
+        # Use a small block size to test multiple blocks.
+        self.block_size = self.TestClass.block_size
+        self.TestClass.block_size = 8
+        self.lines = ("\n", "abcdefgh\n", "ijkl\n", "mnop")
+        with NamedTemporaryFile("wb", delete=False) as stream:
+            self.path = stream.name
+        return
+
+    def tearDown(self):
+        """ Clean up the test fixture.
+
+        This is called after each test is run. This is part of the unittest
+        API.
+
+        """
+        self.TestClass.block_size = self.block_size
+        remove(self.path)
+        return
+
+    def test_write(self):
+        """ Test the write() method.
+
+        """
+        stream = self.TestClass(open(self.path, "wb"))
+        for line in self.lines:
+            stream.write(line)
+        stream.close()
+        with closing(GzipFile(self.path, "rb")) as stream:
+            self.assertEqual("".join(self.lines), stream.read())
+        return
+
+    def test_writelines(self):
+        """ Test the writelines() method.
+
+        """
+        with self.TestClass(open(self.path, "wb"), 1) as stream:
+            stream.writelines(self.lines)
+            stream.writelines(iter(self.lines))
+        with closing(GzipFile(self.path, "rb")) as stream:
+            self.assertEqual("".join(self.lines) * 2, stream.read())
+        return
+
+    def test_close(self):
+        """ Test the close() method.
+
+        """
+        buffer = BytesIO()
+        stream = self.TestClass(buffer)
+        stream.close()
+        self.assertTrue(buffer.closed)
+        return
+
+
+class ParallelGzippedOStreamTest(GzippedOStreamTest):
+    """ Unit testing for the ParallelGzippedOStream class.
+
+    """
+    TestClass = ParallelGzippedOStream
+
+    def test_read(self):
+        """ Test reading the output with GzippedIStream.
+
+        """
+        with self.TestClass(open(self.path, "wb"), threads=2) as stream:
+            stream.writelines(self.lines * 10)
+        with GzippedIStream(open(self.path, "rb")) as stream:
+            self.assertEqual("".join(self.lines * 10), "".join(stream))
+        return
+
+    def test_empty(self):
+        """ Test output with no data.
+
+        """
+        self.TestClass(open(self.path, "wb")).close()
+        with closing(GzipFile(self.path, "rb")) as stream:
+            self.assertEqual("", stream.read())
+        return
+
+
 # Specify the test cases to run for this module (disables automatic discovery).
 
 _TEST_CASES = (BufferedIStreamTest, FilteredIStreamTest, FilteredOStreamTest,
-               GzippedIStreamTest)
+               GzippedIStreamTest, Bzip2IStreamTest, XzIStreamTest,
+               GzippedOStreamTest, ParallelGzippedOStreamTest)
 
 def load_tests(loader, tests, pattern):
     """ Define a TestSuite for this module.
@@ -13,6 +13,7 @@ from serial.core import FixedWidthWriter
 from serial.core import ArrayType
 from serial.core import IntType
 from serial.core import StringType
+from serial.core.dtype import _DataType
 
 
 # Utility functions.
@@ -32,6 +33,25 @@ def modify_filter(record):
     return record
 
 
+class SplitType(_DataType):
+    """ A custom data type that encodes a value as one or more tokens.
+
+    """
+    def __init__(self):
+        """ Initialize this object.
+
+        """
+        super(SplitType, self).__init__(str, None, None)
+        return
+
+    def encode(self, value):
+        """ Split a value into tokens, or return a single token.
+
+        """
+        tokens = value.split(":")
+        return tokens if len(tokens) > 1 else value
+
+
 # Define the TestCase classes for this module. Each public component of the
 # module being tested has its own TestCase.
 
@@ -81,6 +101,22 @@ class _TabularWriterTest(unittest.TestCase):
         self.assertEqual(self.data, self.stream.getvalue())
         return
 
+    def test_write_batch(self):
+        """ Test the write_batch() method.
+
+        """
+        self.writer.write_batch(self.records)
+        self.assertEqual(self.data, self.stream.getvalue())
+        return
+
+    def test_compile(self):
+        """ Test that writers with the same fields share an encoder.
+
+        """
+        writer = self.TestClass(self.stream, *self.args)
+        self.assertIs(self.writer._encode, writer._encode)
+        return
+
 
 class DelimitedWriterTest(_TabularWriterTest):
     """ Unit testing for the DelimitedWriter class.
@@ -116,6 +152,36 @@ class DelimitedWriterTest(_TabularWriterTest):
         self.test_dump()
         return
 
+    def test_write_batch_filter(self):
+        """ Test the write_batch() method with filters.
+
+        """
+        self.writer.filter(reject_filter, modify_filter)
+        self.data = "912,ghi,jklX"
+        self.test_write_batch()
+        return
+
+    def test_default(self):
+        """ Test the encoding of missing fields.
+
+        """
+        self.records = ({"arr": [{"x": "abc"}]},)
+        self.data = ",abc,X"
+        self.test_dump()
+        return
+
+    def test_custom(self):
+        """ Test the encoding of a custom type.
+
+        """
+        fields = (("int", 0, IntType()), ("split", (1, None), SplitType()))
+        self.writer = self.TestClass(self.stream, fields, ",", "X")
+        self.records = ({"int": 123, "split": "abc:def"},
+                        {"int": 456, "split": "ghi"})
+        self.data = "123,abc,defX456,ghiX"
+        self.test_dump()
+        return
+
 
 class FixedWidthWriterTest(_TabularWriterTest):
     """ Unit testing for the DelimitedWriter class.